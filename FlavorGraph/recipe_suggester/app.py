@@ -1,6 +1,9 @@
 import os
+import json
+import time
 import logging
-from flask import Flask, request, jsonify, render_template
+import secrets
+from flask import Flask, Response, request, jsonify, render_template
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
@@ -9,12 +12,72 @@ logger = logging.getLogger(__name__)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'data', 'recipes.db')
+# 'python' (default) or 'vector' (numpy/scipy sparse scoring for large catalogs)
+MATCHER_ENGINE = os.environ.get('MATCHER_ENGINE', 'python')
+# suggest result cache budget: entry count (0 disables), size cap in MB (0 disables), TTL in seconds
+SUGGEST_CACHE_ENTRIES = int(os.environ.get('SUGGEST_CACHE_ENTRIES', 10000))
+SUGGEST_CACHE_MB = float(os.environ.get('SUGGEST_CACHE_MB', 256)) or None
+SUGGEST_CACHE_TTL = float(os.environ.get('SUGGEST_CACHE_TTL', 300))
+# full rankings kept for /api/suggest/page continuation: entry count (0 disables), size cap in MB, TTL
+RANKING_CACHE_ENTRIES = int(os.environ.get('RANKING_CACHE_ENTRIES', 1000))
+RANKING_CACHE_MB = float(os.environ.get('RANKING_CACHE_MB', 64)) or None
+RANKING_CACHE_TTL = float(os.environ.get('RANKING_CACHE_TTL', 600))
+# incremental pantry sessions for /api/suggest/session: how many are kept (LRU), size cap in MB
+# (a session holds a few hundred bytes per candidate recipe) and idle TTL in seconds
+SESSION_ENTRIES = int(os.environ.get('SESSION_ENTRIES', 1000))
+SESSION_CACHE_MB = float(os.environ.get('SESSION_CACHE_MB', 512)) or None
+SESSION_TTL = float(os.environ.get('SESSION_TTL', 1800))
+# upper bound on max_results / page_size a request may ask for
+MAX_RESULTS_LIMIT = int(os.environ.get('MAX_RESULTS_LIMIT', 200))
+# seconds between checks of recipes.db for catalog changes (0 disables hot reload)
+CATALOG_RELOAD_INTERVAL = float(os.environ.get('CATALOG_RELOAD_INTERVAL', 5))
+# binary catalog snapshot to map instead of loading recipes.db (set by serve.py for its workers)
+CATALOG_SNAPSHOT = os.environ.get('CATALOG_SNAPSHOT') or None
+# on-disk index cache mapped at startup when current (prebuild with build_index.py); empty disables
+CATALOG_INDEX = os.environ.get('CATALOG_INDEX', os.path.join(BASE_DIR, 'data', 'recipes.index')) or None
+# fraction of suggest calls run under cProfile for /debug/profile (0 disables)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+
+def _catalog_metrics():
+    out = [('catalog_version', 'gauge', matcher.stats.version, None),
+           ('catalog_recipes', 'gauge', len(matcher.recipes), None)]
+    if suggest_cache is not None:
+        st = suggest_cache.stats()
+        out += [('result_cache_entries', 'gauge', st['entries'], None),
+                ('result_cache_hits_total', 'counter', st['hits'], None),
+                ('result_cache_misses_total', 'counter', st['misses'], None),
+                ('result_cache_evictions_total', 'counter', st['evictions'], None)]
+    return out
 
 # Try to import and initialize recipe matcher but keep server alive on failure
 matcher = None
+suggest_cache = None
+ranking_cache = None
+sessions = None
+metrics = None
 try:
     from recipe_matching import RecipeMatcher
-    matcher = RecipeMatcher(db_path=DB_PATH)
+    from result_cache import ResultCache
+    from metrics import Metrics
+    metrics = Metrics(profile_rate=PROFILE_SAMPLE_RATE)
+    if SUGGEST_CACHE_ENTRIES:
+        suggest_cache = ResultCache(max_entries=SUGGEST_CACHE_ENTRIES,
+                                    max_bytes=int(SUGGEST_CACHE_MB * 1024 * 1024) if SUGGEST_CACHE_MB else None,
+                                    ttl=SUGGEST_CACHE_TTL)
+    if RANKING_CACHE_ENTRIES:
+        ranking_cache = ResultCache(max_entries=RANKING_CACHE_ENTRIES,
+                                    max_bytes=int(RANKING_CACHE_MB * 1024 * 1024) if RANKING_CACHE_MB else None,
+                                    ttl=RANKING_CACHE_TTL)
+    sessions = ResultCache(max_entries=SESSION_ENTRIES,
+                           max_bytes=int(SESSION_CACHE_MB * 1024 * 1024) if SESSION_CACHE_MB else None,
+                           ttl=SESSION_TTL)
+    matcher = RecipeMatcher(db_path=DB_PATH, engine=MATCHER_ENGINE, result_cache=suggest_cache,
+                            snapshot_path=CATALOG_SNAPSHOT, index_path=None if CATALOG_SNAPSHOT else CATALOG_INDEX,
+                            metrics=metrics, ranking_cache=ranking_cache)
+    metrics.describe('response_serialize_seconds', 'histogram', "Time to serialize /api/suggest results to JSON.")
+    metrics.add_collector(_catalog_metrics)
+    if CATALOG_RELOAD_INTERVAL > 0:
+        matcher.start_watcher(CATALOG_RELOAD_INTERVAL)
     logger.info("RecipeMatcher loaded successfully.")
 except Exception as e:
     logger.exception("Could not initialize RecipeMatcher: %s", e)
@@ -25,20 +88,193 @@ def index():
     # make sure templates/index.html exists
     return render_template('index.html')
 
+def _max_results(data, field='max_results', default=20):
+    # clamped so one request can't rank (and cache) the whole catalog; a negative count used to slice from the end
+    return max(0, min(int(data.get(field, default)), MAX_RESULTS_LIMIT))
+
 @app.route('/api/suggest', methods=['POST'])
 def suggest():
     if matcher is None:
         return jsonify({"error": "Recipe matcher unavailable. Check server logs."}), 500
     data = request.get_json() or {}
     user_ings = [i.strip().lower() for i in data.get('ingredients', [])]
-    max_results = int(data.get('max_results', 20))
+    max_results = _max_results(data)
+    include_zero_overlap = bool(data.get('include_zero_overlap', False))
+    # debug_timing: answer {"results": [...], "debug_timing": {...}} with this request's stage timings
+    debug_timing = bool(data.get('debug_timing', False))
     try:
-        results = matcher.suggest(user_ings, max_results=max_results)
-        return jsonify(results)
+        timing = {} if debug_timing else None
+        results = matcher.suggest(user_ings, max_results=max_results, include_zero_overlap=include_zero_overlap,
+                                  timing=timing)
+        t0 = time.perf_counter()
+        response = jsonify(results)
+        serialize = time.perf_counter() - t0
+        if metrics is not None:
+            metrics.observe('response_serialize_seconds', serialize)
+        if debug_timing:
+            timing['stages_ms']['serialize'] = round(serialize * 1000.0, 3)
+            return jsonify({"results": results, "debug_timing": timing})
+        return response
     except Exception as e:
         logger.exception("Error while suggesting: %s", e)
         return jsonify({"error": "internal error"}), 500
 
+@app.route('/api/suggest/page', methods=['POST'])
+def suggest_page():
+    """
+    Body: {"ingredients": [...], "page_size": 20, "include_zero_overlap": false} for the first page,
+    then {"cursor": next_cursor, "page_size": 20} for each following one.
+    Answers {"results": [...], "total": n, "next_cursor": str or null}.
+    """
+    if matcher is None:
+        return jsonify({"error": "Recipe matcher unavailable. Check server logs."}), 500
+    data = request.get_json() or {}
+    user_ings = [i.strip().lower() for i in data.get('ingredients', [])]
+    page_size = _max_results(data, 'page_size')
+    include_zero_overlap = bool(data.get('include_zero_overlap', False))
+    cursor = data.get('cursor') or None
+    if cursor is not None and not isinstance(cursor, str):
+        return jsonify({"error": "cursor must be a string"}), 400
+    try:
+        return jsonify(matcher.suggest_page(user_ings, page_size=page_size, cursor=cursor,
+                                            include_zero_overlap=include_zero_overlap))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error while suggesting page: %s", e)
+        return jsonify({"error": "internal error"}), 500
+
+@app.route('/api/suggest/session', methods=['POST'])
+def suggest_session():
+    """
+    Incremental suggest for chip editing.
+    Body: {"session_id": id or omitted, "ingredients": [...], "add": [...], "remove": [...],
+           "max_results": 20, "include_zero_overlap": false}
+    The session is brought to "ingredients" (the full chip list, when given) and then the
+    add / remove deltas are applied; only recipes reached by the changed ingredients are
+    rescored. An unknown or expired session_id (e.g. one held by another worker) starts a
+    new session, so send "ingredients" for it to be rebuilt transparently.
+    Answers {"session_id": id, "pantry": [...], "results": [...]}.
+    """
+    if matcher is None:
+        return jsonify({"error": "Recipe matcher unavailable. Check server logs."}), 500
+    data = request.get_json() or {}
+    for field in ('ingredients', 'add', 'remove'):
+        if not isinstance(data.get(field, []), list):
+            return jsonify({"error": f"{field} must be a list of ingredient names"}), 400
+    max_results = _max_results(data)
+    include_zero_overlap = bool(data.get('include_zero_overlap', False))
+    session_id = data.get('session_id') or None
+    try:
+        session = sessions.get(session_id) if session_id else None
+        if session is None or session.include_zero_overlap != include_zero_overlap:
+            session_id = session_id or secrets.token_urlsafe(16)
+            session = matcher.session(include_zero_overlap=include_zero_overlap)
+        with session.lock:
+            if 'ingredients' in data:
+                session.set_pantry(data['ingredients'])
+            session.update(add=data.get('add', []), remove=data.get('remove', []))
+            results = session.results(max_results)
+            pantry = session.pantry
+            size = session.size_bytes()
+        sessions.put(session_id, session, size=size)
+        return jsonify({"session_id": session_id, "pantry": pantry, "results": results})
+    except Exception as e:
+        logger.exception("Error while suggesting for session: %s", e)
+        return jsonify({"error": "internal error"}), 500
+
+@app.route('/api/shopping-plan', methods=['POST'])
+def shopping_plan():
+    """
+    Body: {"ingredients": [...], "max_items": 5, "max_results": 20}
+    Answers {"purchases": [{"ingredient", "recipes_unlocked", "gain"}, ...], "total_unlocked": n,
+             "unlocked": [suggestion, ...]}: the ingredients to buy, in pick order, and the recipes they make cookable.
+    """
+    if matcher is None:
+        return jsonify({"error": "Recipe matcher unavailable. Check server logs."}), 500
+    data = request.get_json() or {}
+    user_ings = [i.strip().lower() for i in data.get('ingredients', [])]
+    max_items = int(data.get('max_items', 5))
+    max_results = _max_results(data)
+    if max_items < 1:
+        return jsonify({"error": "max_items must be at least 1"}), 400
+    try:
+        return jsonify(matcher.shopping_plan(user_ings, max_items=max_items, max_results=max_results))
+    except Exception as e:
+        logger.exception("Error while planning shopping: %s", e)
+        return jsonify({"error": "internal error"}), 500
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    if metrics is None:
+        return jsonify({"error": "Metrics unavailable. Check server logs."}), 500
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    """Aggregated cProfile output of the sampled suggest calls (PROFILE_SAMPLE_RATE)."""
+    if metrics is None:
+        return jsonify({"error": "Metrics unavailable. Check server logs."}), 500
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'calls'):
+        return jsonify({"error": "sort must be cumulative, tottime or calls"}), 400
+    return Response(metrics.profile_report(sort=sort), mimetype='text/plain')
+
+@app.route('/api/catalog/stats', methods=['GET'])
+def catalog_stats():
+    if matcher is None:
+        return jsonify({"error": "Recipe matcher unavailable. Check server logs."}), 500
+    return jsonify(matcher.catalog_stats())
+
+@app.route('/api/catalog/reload', methods=['POST'])
+def catalog_reload():
+    if matcher is None:
+        return jsonify({"error": "Recipe matcher unavailable. Check server logs."}), 500
+    data = request.get_json(silent=True) or {}
+    try:
+        reloaded = matcher.reload(full=bool(data.get('full', False)))
+    except Exception as e:
+        logger.exception("Error while reloading catalog: %s", e)
+        return jsonify({"error": "internal error"}), 500
+    return jsonify({"reloaded": reloaded, "version": matcher.stats.version})
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    if suggest_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(suggest_cache.stats(), enabled=True))
+
+@app.route('/api/suggest/batch', methods=['POST'])
+def suggest_batch():
+    """
+    Body: {"pantries": [[ingredient, ...], ...], "max_results": 20}
+    Streams one NDJSON line per pantry: {"index": i, "results": [...]}
+    """
+    if matcher is None:
+        return jsonify({"error": "Recipe matcher unavailable. Check server logs."}), 500
+    data = request.get_json() or {}
+    pantries = data.get('pantries', [])
+    if not isinstance(pantries, list):
+        return jsonify({"error": "pantries must be a list of ingredient lists"}), 400
+    # checked up front: once streaming starts the 200 status has been sent
+    for i, pantry in enumerate(pantries):
+        if not (isinstance(pantry, list) and all(isinstance(name, str) for name in pantry)):
+            return jsonify({"error": f"pantries[{i}] must be a list of ingredient names", "index": i}), 400
+    max_results = _max_results(data)
+    include_zero_overlap = bool(data.get('include_zero_overlap', False))
+
+    def generate():
+        try:
+            results = matcher.iter_suggest_batch(pantries, max_results=max_results,
+                                                 include_zero_overlap=include_zero_overlap)
+            for i, res in enumerate(results):
+                yield json.dumps({"index": i, "results": res}) + "\n"
+        except Exception as e:
+            logger.exception("Error while suggesting batch: %s", e)
+            yield json.dumps({"error": "internal error"}) + "\n"
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
 if __name__ == '__main__':
     # Nimbus / many cloud platforms provide a PORT env var — use it
     port = int(os.environ.get("PORT", 5000))
@@ -0,0 +1,230 @@
+# asgi_app.py
+"""
+ASGI entry point with an asyncio /api/suggest that coalesces identical requests.
+
+    uvicorn asgi_app:app --port 5000
+
+Scoring runs in a thread pool (default) or a process pool (ASGI_EXECUTOR=process), so the
+event loop never blocks on it. In process mode this process plays serve.py's master: it alone
+loads recipes.db (and writes the index cache), publishes the catalog as a snapshot file and
+rewrites it when the DB changes; the pool workers (started with forkserver / spawn, not forked
+from this threaded process) and the Flask routes here map that snapshot read-only.
+Concurrent requests for the same normalized pantry share one computation: the first one
+starts it and the rest await its result. Every other route is served by the Flask app
+from app.py (needs asgiref); without it only the async endpoints are available.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import suggest_worker
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:  # optional dependency, only needed to serve the Flask routes over ASGI
+    WsgiToAsgi = None
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, 'data', 'recipes.db')
+INDEX_PATH = os.path.join(BASE_DIR, 'data', 'recipes.index')
+# 'thread' (default) or 'process'
+ASGI_EXECUTOR = os.environ.get('ASGI_EXECUTOR', 'thread')
+ASGI_WORKERS = int(os.environ.get('ASGI_WORKERS', os.cpu_count() or 2))
+# process mode: the snapshot published for the workers, unless CATALOG_SNAPSHOT names one kept by someone else
+ASGI_SNAPSHOT = os.environ.get('ASGI_SNAPSHOT', os.path.join(BASE_DIR, 'data', 'asgi-catalog.snap'))
+
+
+class CatalogPublisher:
+    """
+    Owns recipes.db for a process pool: loads it once (through the index cache), writes the
+    catalog to snapshot_path and, every interval seconds, reloads it if the DB changed and
+    rewrites the snapshot, which the mapping processes pick up on their own reload check.
+    """
+
+    def __init__(self, db_path, snapshot_path, index_path=None, interval=5.0):
+        from recipe_matching import RecipeMatcher
+        # never scores requests, so it always uses the plain python engine
+        self.matcher = RecipeMatcher(db_path, index_path=index_path)
+        self.snapshot_path = snapshot_path
+        self.publish()
+        self._stop = threading.Event()
+        if interval > 0:
+            threading.Thread(target=self._watch, args=(interval,), name='catalog-publisher', daemon=True).start()
+
+    def publish(self):
+        t0 = time.perf_counter()
+        self.matcher.save_snapshot(self.snapshot_path)
+        logger.info("Published catalog snapshot %s (%d recipes) in %.2fs", self.snapshot_path,
+                    len(self.matcher.recipes), time.perf_counter() - t0)
+
+    def _watch(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                if self.matcher.reload_if_changed():
+                    self.publish()
+            except Exception as e:
+                logger.exception("Catalog reload failed: %s", e)
+
+    def stop(self):
+        self._stop.set()
+
+
+publisher = None
+if ASGI_EXECUTOR == 'process' and not os.environ.get('CATALOG_SNAPSHOT'):
+    publisher = CatalogPublisher(DB_PATH, ASGI_SNAPSHOT, os.environ.get('CATALOG_INDEX', INDEX_PATH) or None,
+                                 float(os.environ.get('CATALOG_RELOAD_INTERVAL', 5)))
+    os.environ['CATALOG_SNAPSHOT'] = ASGI_SNAPSHOT
+
+# imported after the snapshot exists: with CATALOG_SNAPSHOT set its matcher maps it instead of loading the DB
+import app as flask_app  # noqa: E402
+
+
+class RequestCoalescer:
+    """
+    Runs at most one computation per key at a time; callers arriving while it is in
+    flight await the same result. The computation runs as its own task, so a caller
+    that disconnects doesn't cancel it for the others.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.computed = 0
+        self.coalesced = 0
+
+    async def run(self, key, compute):
+        """compute: zero-argument coroutine function, called only if key isn't already in flight."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+            self.computed += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def stats(self):
+        total = self.computed + self.coalesced
+        return {
+            'computed': self.computed,
+            'coalesced': self.coalesced,
+            'coalesce_rate': round(self.coalesced / total, 4) if total else 0.0,
+            'in_flight': len(self._inflight),
+        }
+
+
+class SuggestApp:
+    """ASGI app: async suggest endpoints, everything else delegated to the Flask app."""
+
+    def __init__(self, executor_kind=ASGI_EXECUTOR, workers=ASGI_WORKERS):
+        self.coalescer = RequestCoalescer()
+        self.executor_kind = executor_kind
+        self.workers = workers
+        self.executor = None
+        self.wsgi = WsgiToAsgi(flask_app.app) if WsgiToAsgi is not None else None
+
+    def _executor(self):
+        if self.executor is None:
+            if self.executor_kind == 'process':
+                if not flask_app.CATALOG_SNAPSHOT:
+                    raise RuntimeError("the process executor maps a catalog snapshot; start with ASGI_EXECUTOR=process")
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self.executor = ProcessPoolExecutor(
+                    self.workers, mp_context=context, initializer=suggest_worker.init,
+                    initargs=(flask_app.DB_PATH, flask_app.CATALOG_SNAPSHOT, flask_app.MATCHER_ENGINE,
+                              flask_app.CATALOG_RELOAD_INTERVAL))
+            else:
+                self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='suggest')
+        return self.executor
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        path, method = scope['path'], scope['method']
+        if path == '/api/suggest' and method == 'POST':
+            return await self._suggest(receive, send)
+        if path == '/api/suggest/coalesce-stats' and method == 'GET':
+            return await _send_json(send, 200, self.coalescer.stats())
+        if self.wsgi is not None:
+            return await self.wsgi(scope, receive, send)
+        return await _send_json(send, 404, {"error": "not found"})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _suggest(self, receive, send):
+        matcher = flask_app.matcher
+        if matcher is None and self.executor_kind != 'process':
+            return await _send_json(send, 500, {"error": "Recipe matcher unavailable. Check server logs."})
+        try:
+            data = json.loads(await _read_body(receive) or b'{}')
+            pantry = [i.strip().lower() for i in data.get('ingredients', [])]
+            max_results = flask_app._max_results(data)
+            include_zero_overlap = bool(data.get('include_zero_overlap', False))
+        except (ValueError, TypeError, AttributeError):
+            return await _send_json(send, 400, {"error": "invalid request body"})
+
+        # same normalization as RecipeMatcher, so equivalent pantries share one computation
+        key = (tuple(sorted(set(pantry))), max_results, include_zero_overlap)
+        loop = asyncio.get_running_loop()
+
+        async def compute():
+            if self.executor_kind == 'process':
+                return await loop.run_in_executor(self._executor(), suggest_worker.suggest,
+                                                  list(key[0]), max_results, include_zero_overlap)
+            return await loop.run_in_executor(self._executor(), lambda: matcher.suggest(
+                list(key[0]), max_results=max_results, include_zero_overlap=include_zero_overlap))
+
+        try:
+            results = await self.coalescer.run(key, compute)
+        except Exception as e:
+            logger.exception("Error while suggesting: %s", e)
+            return await _send_json(send, 500, {"error": "internal error"})
+        return await _send_json(send, 200, results)
+
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return body
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            return body
+
+
+async def _send_json(send, status, obj):
+    body = json.dumps(obj).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+app = SuggestApp()
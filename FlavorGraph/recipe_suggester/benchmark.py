@@ -0,0 +1,315 @@
+# benchmark.py
+"""
+Benchmarks for the matching pipeline on synthetic catalogs.
+
+    python benchmark.py --recipes 10000 --out bench-10k.json
+    python benchmark.py --recipes 10000 --compare bench-10k.json
+
+Generates a SQLite catalog with the same schema as seed_db.py (Zipf-skewed ingredient
+popularity, configurable substitution density), then reports load time, peak memory,
+p50/p99 suggest latency and throughput per pantry size, and find_substitutes latency.
+"""
+import argparse
+import bisect
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import accumulate
+
+from schema import create_catalog, install_read_indexes
+from recipe_matching import RecipeMatcher
+from substitution import SubstitutionEngine
+
+CATEGORIES = ['grain', 'legume', 'spice', 'herb', 'vegetable', 'fruit', 'dairy', 'oil',
+              'sweetener', 'protein', 'nut', 'condiment', 'bakery', 'canned']
+CUISINES = ['Telugu', 'Gujarati', 'Marathi', 'South Indian', 'Punjabi', 'Bengali', 'International']
+UNITS = ['g', 'ml', 'pcs', 'cloves', 'tsp']
+
+INSERT_CHUNK = 10000
+
+
+class ZipfSampler:
+    """Draws ranks 0..n-1 with P(k) proportional to 1 / (k + 1) ** s (rank 0 most popular)."""
+
+    def __init__(self, n, s, rng):
+        self.cum = list(accumulate(1.0 / (k + 1) ** s for k in range(n)))
+        self.rng = rng
+
+    def draw(self):
+        return bisect.bisect_left(self.cum, self.rng.random() * self.cum[-1])
+
+    def sample(self, k):
+        """k distinct ranks (k must not exceed n)."""
+        out = set()
+        while len(out) < k:
+            out.add(self.draw())
+        return out
+
+
+def ingredient_name(rank):
+    return f"ingredient {rank:06d}"
+
+
+def generate_catalog(db_path, recipes=10000, ingredients=None, required=(3, 10), optional=(0, 3),
+                     zipf_s=1.1, subst_density=0.3, seed=42):
+    """
+    Write a synthetic catalog to db_path (replacing any catalog there).
+    ingredients defaults to scale with the catalog size; ingredient popularity follows a
+    Zipf distribution; subst_density is the fraction of ingredients with 1-3 substitutes.
+    Returns a summary dict of what was generated.
+    """
+    rng = random.Random(seed)
+    if ingredients is None:
+        ingredients = max(200, min(50000, int(recipes ** 0.5 * 20)))
+    max_per_recipe = min(ingredients, required[1] + optional[1])
+    zipf = ZipfSampler(ingredients, zipf_s, rng)
+
+    conn = sqlite3.connect(db_path)
+    # bulk load: durability doesn't matter for a throwaway catalog
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    create_catalog(conn, drop=True)
+
+    ing_rows = [(k + 1, ingredient_name(k), CATEGORIES[rng.randrange(len(CATEGORIES))], rng.choice(UNITS))
+                for k in range(ingredients)]
+    conn.executemany('INSERT INTO ingredients (id, name, category, unit) VALUES (?, ?, ?, ?)', ing_rows)
+
+    links = 0
+    for start in range(0, recipes, INSERT_CHUNK):
+        recipe_rows, link_rows = [], []
+        for r_id in range(start + 1, min(recipes, start + INSERT_CHUNK) + 1):
+            recipe_rows.append((r_id, f"Recipe {r_id}", rng.choice(CUISINES), rng.randint(1, 6), ''))
+            n_req = rng.randint(*required)
+            n_opt = rng.randint(*optional)
+            ranks = list(zipf.sample(min(max_per_recipe, n_req + n_opt)))
+            rng.shuffle(ranks)
+            for pos, rank in enumerate(ranks):
+                link_rows.append((r_id, rank + 1, rng.randint(1, 500), rng.choice(UNITS), int(pos >= n_req)))
+        conn.executemany('INSERT INTO recipes (id, name, cuisine, servings, instructions) VALUES (?, ?, ?, ?, ?)',
+                         recipe_rows)
+        conn.executemany('INSERT INTO recipe_ingredients (recipe_id, ingredient_id, qty, unit, optional) '
+                         'VALUES (?, ?, ?, ?, ?)', link_rows)
+        links += len(link_rows)
+
+    subst_rows = []
+    for k in range(ingredients):
+        if rng.random() >= subst_density:
+            continue
+        for sub in zipf.sample(min(ingredients - 1, rng.randint(1, 3)) + 1) - {k}:
+            subst_rows.append((k + 1, sub + 1, round(rng.uniform(0.3, 0.95), 2), ''))
+    conn.executemany('INSERT INTO substitutions (ingredient_id, substitute_id, score, notes) VALUES (?, ?, ?, ?)',
+                     subst_rows)
+    conn.commit()
+    install_read_indexes(conn)
+    conn.commit()
+    conn.close()
+    return {'recipes': recipes, 'ingredients': ingredients, 'links': links, 'substitutions': len(subst_rows),
+            'zipf_s': zipf_s, 'subst_density': subst_density, 'seed': seed}
+
+
+def percentile(sorted_values, p):
+    # nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def latency_summary(durations):
+    """durations in seconds -> summary in milliseconds plus throughput."""
+    d = sorted(durations)
+    total = sum(d)
+    ms = lambda x: round(x * 1000.0, 4)
+    return {
+        'n': len(d),
+        'mean_ms': ms(total / len(d)),
+        'p50_ms': ms(percentile(d, 50)),
+        'p90_ms': ms(percentile(d, 90)),
+        'p99_ms': ms(percentile(d, 99)),
+        'max_ms': ms(d[-1]),
+        'qps': round(len(d) / total, 1) if total else None,
+    }
+
+
+def make_pantries(n_ingredients, size, count, zipf_s, seed):
+    # pantries skew towards popular ingredients, like real kitchens
+    rng = random.Random(seed)
+    zipf = ZipfSampler(n_ingredients, zipf_s, rng)
+    size = min(size, n_ingredients)
+    return [[ingredient_name(k) for k in zipf.sample(size)] for _ in range(count)]
+
+
+def bench_load(db_path, engine, memory=True):
+    t0 = time.perf_counter()
+    matcher = RecipeMatcher(db_path, engine=engine)
+    out = {'load_s': round(time.perf_counter() - t0, 4)}
+    if memory:
+        # separate traced load: tracemalloc slows allocation down too much to time it
+        del matcher
+        tracemalloc.start()
+        matcher = RecipeMatcher(db_path, engine=engine)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        out['retained_mb'] = round(current / 2 ** 20, 2)
+        out['peak_mb'] = round(peak / 2 ** 20, 2)
+    return matcher, out
+
+
+def bench_suggest(matcher, pantries, max_results, warmup=5):
+    for p in pantries[:warmup]:
+        matcher.suggest(p, max_results=max_results)
+    durations = []
+    for p in pantries:
+        t0 = time.perf_counter()
+        matcher.suggest(p, max_results=max_results)
+        durations.append(time.perf_counter() - t0)
+    return latency_summary(durations)
+
+
+def bench_substitutes(db_path, names):
+    t0 = time.perf_counter()
+    engine = SubstitutionEngine(db_path)
+    out = {'load_s': round(time.perf_counter() - t0, 4)}
+    for label in ('cold', 'warm'):
+        durations = []
+        for name in names:
+            t0 = time.perf_counter()
+            engine.find_substitutes(name)
+            durations.append(time.perf_counter() - t0)
+        out[label] = latency_summary(durations)
+    return out
+
+
+def run(args):
+    db_path = args.db
+    tmpdir = None
+    if db_path is None:
+        tmpdir = tempfile.TemporaryDirectory(prefix='flavorgraph-bench-')
+        db_path = os.path.join(tmpdir.name, 'catalog.db')
+    try:
+        if args.regenerate or not os.path.exists(db_path):
+            t0 = time.perf_counter()
+            catalog = generate_catalog(db_path, args.recipes, args.ingredients, zipf_s=args.zipf,
+                                       subst_density=args.subst_density, seed=args.seed)
+            catalog['generate_s'] = round(time.perf_counter() - t0, 2)
+            log(f"generated {catalog['recipes']} recipes / {catalog['ingredients']} ingredients "
+                f"in {catalog['generate_s']}s")
+        else:
+            catalog = {'db': db_path, 'reused': True}
+        catalog['db_mb'] = round(os.path.getsize(db_path) / 2 ** 20, 2)
+
+        matcher, load = bench_load(db_path, args.engine, memory=not args.no_memory)
+        conn = sqlite3.connect(db_path)
+        n_ing = conn.execute('SELECT COUNT(*) FROM ingredients').fetchone()[0]
+        conn.close()
+        log(f"loaded in {load['load_s']}s" + (f", peak {load['peak_mb']} MB" if 'peak_mb' in load else ''))
+
+        suggest = {}
+        for size in args.pantry_sizes:
+            pantries = make_pantries(n_ing, size, args.queries, args.zipf, args.seed + size)
+            suggest[str(size)] = s = bench_suggest(matcher, pantries, args.max_results)
+            log(f"suggest pantry={size:<3} p50 {s['p50_ms']:.3f} ms  p99 {s['p99_ms']:.3f} ms  {s['qps']} q/s")
+
+        rng = random.Random(args.seed)
+        names = [ingredient_name(rng.randrange(n_ing)) for _ in range(min(args.queries, n_ing))]
+        substitutes = bench_substitutes(db_path, names)
+        log(f"find_substitutes cold p50 {substitutes['cold']['p50_ms']:.3f} ms  "
+            f"warm p50 {substitutes['warm']['p50_ms']:.3f} ms")
+    finally:
+        if tmpdir is not None:
+            tmpdir.cleanup()
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'engine': args.engine,
+            'max_results': args.max_results,
+            'queries': args.queries,
+        },
+        'catalog': catalog,
+        'load': load,
+        'suggest': suggest,
+        'substitutes': substitutes,
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Print latency ratios against a baseline run; returns the metrics that regressed past tolerance."""
+    regressions = []
+    rows = [('load', 'load_s', result['load'].get('load_s'), baseline.get('load', {}).get('load_s'))]
+    for size, s in result['suggest'].items():
+        b = baseline.get('suggest', {}).get(size, {})
+        for metric in ('p50_ms', 'p99_ms'):
+            rows.append((f"suggest[{size}]", metric, s.get(metric), b.get(metric)))
+    for label in ('cold', 'warm'):
+        b = baseline.get('substitutes', {}).get(label, {})
+        rows.append((f"substitutes.{label}", 'p50_ms', result['substitutes'][label]['p50_ms'], b.get('p50_ms')))
+
+    for name, metric, new, old in rows:
+        if new is None or not old:
+            continue
+        ratio = new / old
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name}.{metric}")
+            flag = '  REGRESSION'
+        log(f"{name:<20} {metric:<7} {old:>10.3f} -> {new:>10.3f}  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def log(msg):
+    print(msg, file=sys.stderr)
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark RecipeMatcher / SubstitutionEngine on a synthetic catalog.")
+    p.add_argument('--recipes', type=int, default=10000, help="recipes to generate (default 10000)")
+    p.add_argument('--ingredients', type=int, default=None, help="ingredient vocabulary size (default scales with recipes)")
+    p.add_argument('--zipf', type=float, default=1.1, help="Zipf exponent of ingredient popularity (default 1.1)")
+    p.add_argument('--subst-density', type=float, default=0.3,
+                   help="fraction of ingredients with explicit substitutes (default 0.3)")
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--db', default=None,
+                   help="catalog path; generated if missing and reused otherwise (default: temporary file)")
+    p.add_argument('--regenerate', action='store_true', help="regenerate --db even if it exists")
+    p.add_argument('--engine', choices=RecipeMatcher.ENGINES, default='python')
+    p.add_argument('--pantry-sizes', type=int, nargs='+', default=[3, 5, 10, 20])
+    p.add_argument('--queries', type=int, default=200, help="suggest calls per pantry size (default 200)")
+    p.add_argument('--max-results', type=int, default=20)
+    p.add_argument('--no-memory', action='store_true', help="skip the tracemalloc peak-memory load")
+    p.add_argument('--out', default=None, help="write results as JSON to this file ('-' for stdout)")
+    p.add_argument('--compare', default=None, help="baseline results JSON to compare against")
+    p.add_argument('--tolerance', type=float, default=0.2,
+                   help="allowed slowdown vs --compare before exiting non-zero (default 0.2 = 20%%)")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run(args)
+    if args.out == '-':
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    elif args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+        log(f"results written to {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            log("regressed: " + ', '.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
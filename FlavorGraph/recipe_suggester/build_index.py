@@ -0,0 +1,76 @@
+# build_index.py
+"""
+Prebuild the on-disk index cache during deploy so servers start by mapping it.
+
+    python build_index.py                 # build data/recipes.index if missing or stale
+    python build_index.py --force         # rebuild even if it is current
+    python build_index.py --check         # exit 1 if the index is missing or stale
+
+The index is a catalog snapshot file (snapshot_file.py) whose header records the
+fingerprint of the recipes.db it was built from; RecipeMatcher(index_path=...) maps it
+directly when the fingerprint still matches.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from recipe_matching import RecipeMatcher
+from snapshot_file import read_header
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, 'data', 'recipes.db')
+INDEX_PATH = os.path.join(BASE_DIR, 'data', 'recipes.index')
+
+
+def index_is_current(db_path, index_path):
+    try:
+        return read_header(index_path).get('fingerprint') == RecipeMatcher.db_fingerprint(db_path)
+    except (FileNotFoundError, ValueError):
+        return False
+
+
+def build_index(db_path, index_path, force=False):
+    """
+    Make index_path current for db_path (rebuilding it if stale, or always with force).
+    Returns (recipe count, seconds spent); raises RuntimeError if the index couldn't be written.
+    """
+    if force and os.path.exists(index_path):
+        os.unlink(index_path)
+    t0 = time.perf_counter()
+    matcher = RecipeMatcher(db_path, index_path=index_path)
+    if not index_is_current(db_path, index_path):
+        raise RuntimeError(f"could not write {index_path} (see log)")
+    return len(matcher.recipes), time.perf_counter() - t0
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Build the RecipeMatcher index cache for a recipes DB.")
+    p.add_argument('--db', default=DB_PATH)
+    p.add_argument('--out', default=os.environ.get('CATALOG_INDEX') or INDEX_PATH)
+    p.add_argument('--force', action='store_true', help="rebuild even if the index is current")
+    p.add_argument('--check', action='store_true', help="only report whether the index is current")
+    args = p.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if not os.path.exists(args.db):
+        sys.exit(f"SQLite DB not found at: {args.db}")
+    current = index_is_current(args.db, args.out)
+    if args.check:
+        print(f"{args.out}: {'current' if current else 'missing or stale'}")
+        return 0 if current else 1
+    if current and not args.force:
+        print(f"{args.out} is current")
+        return 0
+
+    try:
+        recipes, seconds = build_index(args.db, args.out, force=args.force)
+    except RuntimeError as e:
+        sys.exit(str(e))
+    print(f"built {args.out}: {recipes} recipes, {os.path.getsize(args.out) / 2 ** 20:.1f} MB in {seconds:.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
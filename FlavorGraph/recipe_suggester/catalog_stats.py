@@ -0,0 +1,53 @@
+# catalog_stats.py
+import math
+import time
+
+class CatalogStats:
+    """
+    Statistics derived from the recipe catalog (popularity, rarity, sizes).
+    Built once per catalog load; version increases on every reload so cached
+    results computed against an older catalog can be recognised.
+    """
+    DEFAULT_RARITY = 0.2
+
+    def __init__(self, version, vocab, recipes, req_ings, opt_ings, ingredient_popularity):
+        self._init(version, vocab, len(recipes), ingredient_popularity,
+                   sum(len(v) for v in req_ings.values()), sum(len(v) for v in opt_ings.values()), time.time())
+
+    @classmethod
+    def restore(cls, version, vocab, recipe_count, ingredient_popularity, required_links, optional_links, built_at):
+        """Stats for a catalog whose sizes were saved with it (see snapshot_file.py), without walking it again."""
+        stats = cls.__new__(cls)
+        stats._init(version, vocab, recipe_count, ingredient_popularity, required_links, optional_links, built_at)
+        return stats
+
+    def _init(self, version, vocab, recipe_count, ingredient_popularity, required_links, optional_links, built_at):
+        self.version = version
+        self.built_at = built_at
+        self.vocab = vocab
+        self.recipe_count = recipe_count
+        self.popularity = dict(ingredient_popularity)  # ingredient id -> number of recipes using it
+        # rarity_score(ing) = 1 / (1 + log(1 + popularity)); rarer ingredients score higher
+        self.rarity = {ing: 1.0 / (1.0 + math.log(1 + pop)) for ing, pop in self.popularity.items()}
+        self.required_links = required_links
+        self.optional_links = optional_links
+
+    def rarity_of(self, ingredient_id):
+        return self.rarity.get(ingredient_id, self.DEFAULT_RARITY)
+
+    def top_ingredients(self, n=10):
+        """Most used ingredients as (name, recipe count), most popular first."""
+        named = [(self.vocab.name_of(i), pop) for i, pop in self.popularity.items()]
+        return sorted(named, key=lambda x: (-x[1], x[0]))[:n]
+
+    def summary(self):
+        return {
+            'version': self.version,
+            'built_at': self.built_at,
+            'recipe_count': self.recipe_count,
+            'ingredient_count': len(self.popularity),
+            'required_links': self.required_links,
+            'optional_links': self.optional_links,
+            'avg_required_per_recipe': round(self.required_links / max(1, self.recipe_count), 3),
+            'top_ingredients': self.top_ingredients(),
+        }
@@ -0,0 +1,77 @@
+# db.py
+"""
+Read access to recipes.db shared by RecipeMatcher and SubstitutionEngine.
+
+Each thread gets one long-lived read-only connection per database (so the sqlite3
+statement cache keeps the loader's prepared statements across reloads) opened with
+pragmas tuned for scans: a large page cache and the file memory-mapped. Writers
+(seed_db.py, ingestion) open their own connections.
+"""
+import os
+import sqlite3
+import threading
+
+# pragmas for the read connections; mmap is capped by SQLite's compile-time limit
+MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_MB', 256)) * 2 ** 20
+CACHE_KIB = int(os.environ.get('SQLITE_CACHE_MB', 64)) * 1024
+CACHED_STATEMENTS = 256
+
+
+class ConnectionPool:
+    """
+    Per-thread read-only connections to one database file. connection() returns the
+    calling thread's connection, reopening it if the file was replaced or the process
+    forked since it was opened. Connections are in autocommit mode; callers wanting a
+    consistent view across several queries wrap them in BEGIN / COMMIT themselves.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = os.path.abspath(db_path)
+        self._local = threading.local()
+
+    def connection(self):
+        ident = (os.getpid(), _file_id(self.db_path))
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.ident == ident:
+            return conn
+        if conn is not None and self._local.ident[0] == ident[0]:
+            conn.close()
+        self._local.conn = conn = self._open()
+        self._local.ident = ident
+        return conn
+
+    def _open(self):
+        uri = 'file:{}?mode=ro'.format(self.db_path.replace('?', '%3f').replace('#', '%23'))
+        conn = sqlite3.connect(uri, uri=True, isolation_level=None, cached_statements=CACHED_STATEMENTS)
+        conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        conn.execute(f'PRAGMA cache_size = -{CACHE_KIB}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    def close(self):
+        """Close the calling thread's connection (other threads' close when the thread exits)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def pool_for(db_path):
+    """The process-wide ConnectionPool for db_path, so every reader of a DB shares one."""
+    db_path = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ConnectionPool(db_path)
+        return pool
+
+
+def _file_id(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_dev, st.st_ino)
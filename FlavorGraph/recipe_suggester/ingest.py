@@ -0,0 +1,352 @@
+# ingest.py
+"""
+Stream recipes from CSV / JSONL files into recipes.db in large batches.
+
+    python ingest.py recipes.jsonl                      # append to data/recipes.db
+    python ingest.py dump.csv.gz --replace --batch 100000
+
+JSONL: one recipe per line,
+    {"name": "Poha", "cuisine": "Marathi", "servings": 2, "instructions": "...",
+     "ingredients": ["poha", {"name": "peanuts", "qty": 30, "unit": "g", "optional": true, "category": "nut"}]}
+where "ingredients" may also be a string of names separated by ';', as in CSV.
+
+CSV: either one row per recipe with an `ingredients` column (a JSON list, or names separated
+by ';'), or one row per recipe ingredient with `ingredient`, `qty`, `unit`, `optional` and
+`category` columns, where consecutive rows with the same `recipe_id` (or `recipe`) make up one
+recipe. Recipe columns are `name` (or `recipe`), `cuisine`, `servings` and `instructions`.
+`.gz` files are read compressed.
+
+Ingredients are matched on their normalized name (trimmed, lowercased) and created when
+missing. Rows go in with executemany, one transaction per batch. Loading into an empty
+catalog drops the secondary indexes first and builds them afterwards; row-by-row change-log
+triggers are suspended and the new rows are logged in one statement at the end, so running
+servers pick them up on their next reload. Finally the read indexes and the index cache
+(build_index.py) are rebuilt.
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from itertools import groupby
+
+from schema import (create_catalog, drop_change_log_triggers, drop_read_indexes, enable_wal, has_change_log,
+                    install_change_log, install_read_indexes)
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, 'data', 'recipes.db')
+INDEX_PATH = os.path.join(BASE_DIR, 'data', 'recipes.index')
+
+# recipes per transaction
+BATCH_SIZE = 50000
+
+
+def normalize(name):
+    """Ingredient names as the matcher compares them."""
+    return name.strip().lower()
+
+
+class CatalogLoader:
+    """
+    Appends recipe records (dicts as described in the module docstring) to an open catalog,
+    batch_size recipes per transaction. Ids are assigned here, so a batch is three
+    executemany calls: new ingredients, recipes, recipe_ingredients.
+    """
+
+    def __init__(self, conn, batch_size=BATCH_SIZE, progress=None):
+        """progress: optional callable(loader) run after every committed batch"""
+        self.conn = conn
+        self.batch_size = batch_size
+        self.progress = progress
+        self.ingredient_ids = {}
+        for ing_id, name in conn.execute('SELECT id, name FROM ingredients ORDER BY id'):
+            self.ingredient_ids.setdefault(normalize(name), ing_id)
+        self.first_recipe_id = self.next_recipe_id = _next_id(conn, 'recipes')
+        self.first_ingredient_id = self.next_ingredient_id = _next_id(conn, 'ingredients')
+        self.recipes = self.links = self.new_ingredients = self.skipped = 0
+        self.started = time.perf_counter()
+        self._ingredient_rows, self._recipe_rows, self._link_rows = [], [], []
+
+    def add(self, record):
+        """Queue one recipe; returns its id, or None if it was skipped (no name, or ingredients not a list)."""
+        name = str(record.get('name') or '').strip()
+        ingredients = record.get('ingredients') or ()
+        if isinstance(ingredients, str):
+            ingredients = _split_ingredients(ingredients)
+        if not isinstance(ingredients, (list, tuple)):
+            logger.warning("skipping recipe %r: ingredients must be a list or a ';'-separated string", name)
+            self.skipped += 1
+            return None
+        links = {}  # ingredient name -> (qty, unit, optional, category); required wins over optional
+        for item in ingredients:
+            if not isinstance(item, dict):
+                item = {'name': item}
+            ing = normalize(str(item.get('name') or ''))
+            if not ing:
+                continue
+            optional = int(_truthy(item.get('optional')))
+            if ing not in links or not optional:
+                links[ing] = (_number(item.get('qty')), item.get('unit') or None, optional,
+                              item.get('category') or None)
+        if not name:
+            self.skipped += 1
+            return None
+
+        r_id = self.next_recipe_id
+        self.next_recipe_id += 1
+        self._recipe_rows.append((r_id, name, record.get('cuisine') or None,
+                                  int(_number(record.get('servings')) or 1), record.get('instructions') or ''))
+        for ing, (qty, unit, optional, category) in links.items():
+            ing_id = self.ingredient_ids.get(ing)
+            if ing_id is None:
+                ing_id = self.ingredient_ids[ing] = self.next_ingredient_id
+                self.next_ingredient_id += 1
+                self._ingredient_rows.append((ing_id, ing, category, unit))
+            self._link_rows.append((r_id, ing_id, qty, unit, optional))
+        if len(self._recipe_rows) >= self.batch_size:
+            self.flush()
+        return r_id
+
+    def add_all(self, records):
+        for record in records:
+            self.add(record)
+        self.flush()
+        return self
+
+    def flush(self):
+        """Write the queued rows in one transaction."""
+        if not self._recipe_rows:
+            return
+        conn = self.conn
+        if not conn.in_transaction:
+            conn.execute('BEGIN')
+        try:
+            conn.executemany('INSERT INTO ingredients (id, name, category, unit) VALUES (?, ?, ?, ?)',
+                             self._ingredient_rows)
+            conn.executemany('INSERT INTO recipes (id, name, cuisine, servings, instructions) VALUES (?, ?, ?, ?, ?)',
+                             self._recipe_rows)
+            conn.executemany('INSERT INTO recipe_ingredients (recipe_id, ingredient_id, qty, unit, optional) '
+                             'VALUES (?, ?, ?, ?, ?)', self._link_rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self.recipes += len(self._recipe_rows)
+        self.links += len(self._link_rows)
+        self.new_ingredients += len(self._ingredient_rows)
+        self._ingredient_rows, self._recipe_rows, self._link_rows = [], [], []
+        if self.progress is not None:
+            self.progress(self)
+
+    def rows_per_second(self):
+        elapsed = time.perf_counter() - self.started
+        return (self.recipes + self.links + self.new_ingredients) / elapsed if elapsed > 0 else 0.0
+
+
+def _next_id(conn, table):
+    # AUTOINCREMENT tables never reuse an id, even of a deleted row
+    top = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+    try:
+        row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+    except sqlite3.OperationalError:  # no AUTOINCREMENT row inserted yet
+        row = None
+    return max(top, row[0] if row else 0) + 1
+
+
+def _truthy(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y', 'optional')
+    return bool(value)
+
+
+def _number(value):
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# --- readers: each yields recipe records ---
+
+def read_records(path, fmt=None):
+    """Recipe records from a CSV or JSONL file ('-' reads stdin; fmt is then required)."""
+    fmt = fmt or _format_of(path)
+    if path == '-':
+        f = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+    elif path.endswith('.gz'):
+        f = gzip.open(path, 'rt', encoding='utf-8', newline='')
+    else:
+        f = open(path, encoding='utf-8', newline='')
+    with f:
+        yield from (read_jsonl(f) if fmt == 'jsonl' else read_csv(f))
+
+
+def _format_of(path):
+    base = path[:-3] if path.endswith('.gz') else path
+    ext = os.path.splitext(base)[1].lower()
+    if ext in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if ext == '.csv':
+        return 'csv'
+    raise ValueError(f"can't tell the format of {path}; pass --format")
+
+
+def read_jsonl(f):
+    for lineno, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            logger.warning("line %d: skipping malformed JSON (%s)", lineno, e)
+            record = {}
+        yield record if isinstance(record, dict) else {}
+
+
+def read_csv(f):
+    reader = csv.DictReader(f)
+    fields = reader.fieldnames or []
+    if 'ingredients' in fields:
+        for row in reader:
+            yield _recipe_fields(row, _split_ingredients(row.get('ingredients') or ''))
+    elif 'ingredient' in fields:
+        key = 'recipe_id' if 'recipe_id' in fields else 'recipe' if 'recipe' in fields else 'name'
+        for _, rows in groupby(reader, key=lambda row: row.get(key)):
+            rows = list(rows)
+            yield _recipe_fields(rows[0], [{'name': row.get('ingredient'), 'qty': row.get('qty'),
+                                            'unit': row.get('unit'), 'optional': row.get('optional'),
+                                            'category': row.get('category')} for row in rows])
+    else:
+        raise ValueError("CSV input needs an 'ingredients' column (one row per recipe) "
+                         "or an 'ingredient' column (one row per recipe ingredient)")
+
+
+def _recipe_fields(row, ingredients):
+    return {'name': row.get('name') or row.get('recipe'), 'cuisine': row.get('cuisine'),
+            'servings': row.get('servings'), 'instructions': row.get('instructions'),
+            'ingredients': ingredients}
+
+
+def _split_ingredients(cell):
+    cell = cell.strip()
+    if cell.startswith('['):
+        try:
+            return json.loads(cell)
+        except ValueError:
+            pass
+    return [part for part in cell.split(';') if part.strip()]
+
+
+# --- the whole pipeline ---
+
+def ingest(db_path, records, replace=False, batch_size=BATCH_SIZE, index_path=None, progress=None):
+    """
+    Load records into db_path and rebuild what the matcher derives from the catalog.
+    replace=True empties the catalog first. Returns a summary dict.
+    """
+    created = not os.path.exists(db_path)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA cache_size = -262144')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    t0 = time.perf_counter()
+    try:
+        had_log = has_change_log(conn)
+        last_change = conn.execute('SELECT COALESCE(MAX(id), 0) FROM catalog_changes').fetchone()[0] if had_log else 0
+        create_catalog(conn, drop=replace)
+        existing = conn.execute('SELECT COUNT(*) FROM recipes').fetchone()[0]
+        # building the secondary indexes once after the load beats maintaining them per row
+        if existing == 0:
+            drop_read_indexes(conn)
+        if had_log and not replace:
+            drop_change_log_triggers(conn)
+        loader = CatalogLoader(conn, batch_size, progress)
+        try:
+            loader.add_all(records)
+        finally:
+            # whatever was committed has to be indexed and logged, even if the load failed part way;
+            # a new DB gets the change log too, like a seeded one, with the load as its first entry
+            if had_log or created:
+                install_change_log(conn)
+                _log_loaded(conn, loader, full=replace or loader.recipes >= existing, after=last_change)
+            t_load = time.perf_counter()
+            install_read_indexes(conn)
+            t_indexes = time.perf_counter()
+        if created or replace:
+            enable_wal(conn)
+    finally:
+        conn.close()
+
+    summary = {
+        'recipes': loader.recipes, 'links': loader.links, 'new_ingredients': loader.new_ingredients,
+        'skipped': loader.skipped, 'load_s': round(t_load - t0, 2),
+        'rows_per_s': round((loader.recipes + loader.links + loader.new_ingredients) / max(t_load - t0, 1e-9)),
+        'indexes_s': round(t_indexes - t_load, 2),
+    }
+    if index_path and loader.recipes:
+        from build_index import build_index
+        _, seconds = build_index(db_path, index_path)
+        summary['index_cache_s'] = round(seconds, 2)
+    return summary
+
+
+def _log_loaded(conn, loader, full, after):
+    """
+    Record the load in catalog_changes: the new rows one by one for a small append, or a
+    single 'catalog' entry (servers rebuild from scratch) when the load replaced or outgrew
+    what was there. Ids continue after `after` so a recreated log still moves forward.
+    """
+    conn.execute('BEGIN')
+    if full:
+        conn.execute("INSERT INTO catalog_changes (id, entity, entity_id) VALUES "
+                     "(MAX(?, (SELECT COALESCE(MAX(id), 0) FROM catalog_changes)) + 1, 'catalog', 0)", (after,))
+    else:
+        conn.execute("INSERT INTO catalog_changes (entity, entity_id) SELECT 'ingredient', id FROM ingredients "
+                     "WHERE id >= ?", (loader.first_ingredient_id,))
+        conn.execute("INSERT INTO catalog_changes (entity, entity_id) SELECT 'recipe', id FROM recipes "
+                     "WHERE id >= ?", (loader.first_recipe_id,))
+    conn.commit()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Bulk-load recipes from CSV / JSONL files into the catalog DB.")
+    p.add_argument('inputs', nargs='+', help="CSV or JSONL files (optionally .gz; '-' for stdin)")
+    p.add_argument('--db', default=DB_PATH)
+    p.add_argument('--format', choices=['csv', 'jsonl'], default=None, help="default: from the file extension")
+    p.add_argument('--replace', action='store_true', help="empty the catalog before loading")
+    p.add_argument('--batch', type=int, default=BATCH_SIZE, help=f"recipes per transaction (default {BATCH_SIZE})")
+    p.add_argument('--index', default=os.environ.get('CATALOG_INDEX', INDEX_PATH),
+                   help="index cache to rebuild after the load (empty skips it)")
+    args = p.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    def progress(loader):
+        print(f"{loader.recipes:,} recipes, {loader.links:,} ingredient links, "
+              f"{loader.new_ingredients:,} new ingredients  ({loader.rows_per_second():,.0f} rows/s)",
+              file=sys.stderr)
+
+    records = (record for path in args.inputs for record in read_records(path, args.format))
+    try:
+        summary = ingest(args.db, records, replace=args.replace, batch_size=args.batch,
+                         index_path=args.index or None, progress=progress)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        sys.exit(f"ingest failed: {e}")
+    print(f"loaded {summary['recipes']:,} recipes ({summary['links']:,} ingredient links, "
+          f"{summary['new_ingredients']:,} new ingredients, {summary['skipped']:,} skipped) in {summary['load_s']}s "
+          f"= {summary['rows_per_s']:,} rows/s; indexes {summary['indexes_s']}s"
+          + (f", index cache {summary['index_cache_s']}s" if 'index_cache_s' in summary else ''))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
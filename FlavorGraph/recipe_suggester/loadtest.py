@@ -0,0 +1,498 @@
+# loadtest.py
+"""
+Load / soak test for the HTTP API with latency SLO gating.
+
+    python loadtest.py --duration 60 --concurrency 16 --rps 200 --p99-ms 250
+    python loadtest.py --duration 3600 --report-every 60 --out soak.json
+    python loadtest.py --url http://127.0.0.1:5000 --rps 0 --concurrency 32
+
+Starts serve.py on a free local port against --db (unless --url points at a running
+server), then replays pantries whose ingredients are drawn Zipf-skewed over the catalog's
+own ingredient popularity ranking, across a weighted mix of endpoints. With --rps the
+load is open loop: request i is due at start + i / rps and its latency is measured from
+that due time, so a server that stalls shows the queueing it caused instead of hiding it.
+--rps 0 runs closed loop, each connection sending as fast as it gets answers.
+Reports throughput, error rate, latency percentiles and a histogram per endpoint, and
+exits 1 when any endpoint's p99 exceeds --p99-ms or its error rate --max-error-rate.
+Standard library only, so it runs offline on the box being measured.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from benchmark import ZipfSampler, percentile
+from metrics import DEFAULT_BUCKETS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, 'data', 'recipes.db')
+
+DEFAULT_MIX = 'suggest=80,page=5,session=10,shopping=5'
+# connection-level failures worth one transparent retry (the server closed an idle keep-alive)
+RETRYABLE = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+def ingredient_ranking(db_path):
+    """Ingredient names, most used first (the ranking pantries are drawn over)."""
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        rows = conn.execute('''SELECT i.name, COUNT(*) AS n FROM recipe_ingredients ri
+                               JOIN ingredients i ON i.id = ri.ingredient_id
+                               GROUP BY ri.ingredient_id ORDER BY n DESC, i.name''').fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        raise SystemExit(f"no recipe ingredients in {db_path}")
+    return [name.lower() for name, _ in rows]
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}; expected one of {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    if not any(w > 0 for w in mix.values()):
+        raise argparse.ArgumentTypeError("mix needs at least one positive weight")
+    return mix
+
+
+class Recorder:
+    """Latencies and errors per endpoint; thread-safe, with an interval view for progress lines."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.latencies = {}     # endpoint -> [seconds]
+        self.errors = {}        # endpoint -> {kind: count}
+        self._interval = []     # (latency, ok) since the last progress line
+
+    def record(self, endpoint, latency, error=None):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(latency)
+            if error is not None:
+                kinds = self.errors.setdefault(endpoint, {})
+                kinds[error] = kinds.get(error, 0) + 1
+            self._interval.append((latency, error is None))
+
+    def take_interval(self):
+        with self._lock:
+            out, self._interval = self._interval, []
+        return out
+
+    def summary(self, endpoint, elapsed):
+        d = sorted(self.latencies.get(endpoint, ()))
+        errors = sum(self.errors.get(endpoint, {}).values())
+        ms = lambda x: round(x * 1000.0, 3) if x is not None else None
+        counts = [0] * (len(self.buckets) + 1)
+        i = 0
+        for x in d:
+            while i < len(self.buckets) and x > self.buckets[i]:
+                i += 1
+            counts[i] += 1
+        return {
+            'n': len(d),
+            'errors': errors,
+            'error_rate': round(errors / len(d), 5) if d else 0.0,
+            'error_kinds': dict(self.errors.get(endpoint, {})),
+            'throughput_rps': round(len(d) / elapsed, 2) if elapsed else None,
+            'mean_ms': ms(sum(d) / len(d)) if d else None,
+            'p50_ms': ms(percentile(d, 50)),
+            'p90_ms': ms(percentile(d, 90)),
+            'p99_ms': ms(percentile(d, 99)),
+            'max_ms': ms(d[-1]) if d else None,
+            # count per latency bucket: le_<ms> for each upper bound, then everything slower
+            'histogram': {**{f"le_{b * 1000:g}ms": c for b, c in zip(self.buckets, counts)},
+                          f"gt_{self.buckets[-1] * 1000:g}ms": counts[-1]},
+        }
+
+
+class Client:
+    """
+    One keep-alive connection plus the per-user state of the stateful endpoints: the
+    chip list of a pantry session and an unfinished pagination cursor.
+    """
+
+    def __init__(self, url, rng, pantries, max_results, timeout):
+        parts = urllib.parse.urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.rng = rng
+        self.pantries = pantries
+        self.max_results = max_results
+        self.timeout = timeout
+        self.conn = None
+        self.session_id = None
+        self.chips = []
+        self.cursor = None
+
+    def post(self, path, body):
+        """(status, parsed JSON body or None); one reconnect when a kept-alive connection was dropped."""
+        payload = json.dumps(body).encode()
+        for attempt in (0, 1):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request('POST', path, payload, {'Content-Type': 'application/json'})
+                resp = self.conn.getresponse()
+                data = resp.read()
+                break
+            except RETRYABLE:
+                self.close()
+                if attempt:
+                    raise
+            except Exception:
+                self.close()
+                raise
+        if resp.getheader('Content-Type', '').startswith('application/x-ndjson'):
+            return resp.status, [json.loads(line) for line in data.splitlines() if line.strip()]
+        return resp.status, json.loads(data) if data else None
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    # one method per endpoint: returns (status, body) of the request it sent
+
+    def suggest(self):
+        return self.post('/api/suggest', {'ingredients': self.pantries.draw(self.rng),
+                                          'max_results': self.max_results})
+
+    def page(self):
+        if self.cursor:
+            status, body = self.post('/api/suggest/page', {'cursor': self.cursor, 'page_size': self.max_results})
+        else:
+            status, body = self.post('/api/suggest/page', {'ingredients': self.pantries.draw(self.rng),
+                                                           'page_size': self.max_results})
+        # keep paging through the same result list now and then, as a user scrolling would
+        self.cursor = body.get('next_cursor') if status == 200 and self.rng.random() < 0.5 else None
+        return status, body
+
+    def session(self):
+        # edit one chip: add a popular ingredient, or remove one once the pantry has a few
+        if len(self.chips) > 2 and (len(self.chips) >= 15 or self.rng.random() < 0.4):
+            self.chips.remove(self.rng.choice(self.chips))
+        else:
+            name = self.pantries.draw_one(self.rng)
+            if name not in self.chips:
+                self.chips.append(name)
+        status, body = self.post('/api/suggest/session', {'session_id': self.session_id, 'ingredients': self.chips,
+                                                          'max_results': self.max_results})
+        if status == 200:
+            self.session_id = body['session_id']
+        return status, body
+
+    def shopping(self):
+        return self.post('/api/shopping-plan', {'ingredients': self.pantries.draw(self.rng), 'max_items': 5,
+                                                'max_results': self.max_results})
+
+    def batch(self):
+        pantries = [self.pantries.draw(self.rng) for _ in range(8)]
+        status, lines = self.post('/api/suggest/batch', {'pantries': pantries, 'max_results': self.max_results})
+        if status == 200 and any('error' in line for line in lines):
+            return 500, lines
+        return status, lines
+
+
+ENDPOINTS = {
+    'suggest': Client.suggest,
+    'page': Client.page,
+    'session': Client.session,
+    'shopping': Client.shopping,
+    'batch': Client.batch,
+}
+
+
+class PantryDistribution:
+    """Pantries of min..max ingredients drawn Zipf-skewed over the catalog popularity ranking."""
+
+    def __init__(self, names, sizes, zipf_s):
+        self.names = names
+        self.sizes = (min(sizes[0], len(names)), min(sizes[1], len(names)))
+        self.zipf_s = zipf_s
+        self._samplers = {}
+
+    def _sampler(self, rng):
+        # ZipfSampler keeps its own rng; one per client rng so threads don't share state
+        sampler = self._samplers.get(id(rng))
+        if sampler is None:
+            sampler = self._samplers[id(rng)] = ZipfSampler(len(self.names), self.zipf_s, rng)
+        return sampler
+
+    def draw(self, rng):
+        return [self.names[k] for k in self._sampler(rng).sample(rng.randint(*self.sizes))]
+
+    def draw_one(self, rng):
+        return self.names[self._sampler(rng).draw()]
+
+
+def run_load(args, url, pantries, recorder):
+    """Drive the load for warmup + duration seconds; returns the measured window's length in seconds."""
+    endpoints = list(args.mix)
+    weights = [args.mix[e] for e in endpoints]
+    lock = threading.Lock()
+    state = {'next': 0}
+    start = time.perf_counter() + 0.1
+    measure_from = start + args.warmup
+    stop_at = measure_from + args.duration
+
+    def worker(i):
+        rng = random.Random(args.seed * 1000 + i)
+        client = Client(url, rng, pantries, args.max_results, args.timeout)
+        # build the Zipf tables before the clock starts
+        pantries.draw(rng)
+        try:
+            while True:
+                if args.rps > 0:
+                    with lock:
+                        slot = state['next']
+                        state['next'] += 1
+                    due = start + slot / args.rps
+                    if due >= stop_at:
+                        return
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                else:
+                    due = time.perf_counter()
+                    if due >= stop_at:
+                        return
+                endpoint = rng.choices(endpoints, weights)[0]
+                error = None
+                try:
+                    status, _ = ENDPOINTS[endpoint](client)
+                    if status != 200:
+                        error = f"http_{status}"
+                except Exception as e:
+                    error = type(e).__name__
+                done = time.perf_counter()
+                if due >= measure_from:
+                    recorder.record(endpoint, done - due, error)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), name=f'load-{i}', daemon=True)
+               for i in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    next_report = measure_from + args.report_every if args.report_every else None
+    last_report = measure_from
+    while any(t.is_alive() for t in threads):
+        for t in threads:
+            t.join(0.2)
+        now = time.perf_counter()
+        if next_report is not None and now >= next_report:
+            progress(recorder.take_interval(), now - measure_from, now - last_report)
+            last_report = now
+            next_report += args.report_every
+    return args.duration
+
+
+def progress(interval, elapsed, window):
+    lat = sorted(x for x, _ in interval)
+    errors = sum(1 for _, ok in interval if not ok)
+    p99 = percentile(lat, 99)
+    log(f"[{elapsed:7.1f}s] {len(lat) / window:8.1f} req/s  errors {errors:<5} "
+        f"p99 {p99 * 1000 if p99 is not None else 0:8.2f} ms")
+
+
+class LocalServer:
+    """serve.py on a free loopback port, stopped (SIGTERM) on exit."""
+
+    def __init__(self, args):
+        self.args = args
+        self.proc = None
+        self.tmpdir = None
+
+    def __enter__(self):
+        args = self.args
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        self.tmpdir = tempfile.TemporaryDirectory(prefix='flavorgraph-load-')
+        env = dict(os.environ)
+        for item in args.server_env:
+            key, _, value = item.partition('=')
+            env[key] = value
+        env.setdefault('MATCHER_ENGINE', args.engine)
+        cmd = [sys.executable, os.path.join(BASE_DIR, 'serve.py'), '--host', '127.0.0.1', '--port', str(port),
+               '--workers', str(args.workers), '--db', args.db,
+               '--snapshot', os.path.join(self.tmpdir.name, 'catalog.snap'), '--reload-interval', '0',
+               # no index cache: the default one belongs to data/recipes.db, not whatever --db is under test
+               '--index', '']
+        log_file = open(os.path.join(self.tmpdir.name, 'server.log'), 'w')
+        self.proc = subprocess.Popen(cmd, cwd=BASE_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+        log_file.close()
+        self.url = f"http://127.0.0.1:{port}"
+        self._wait_ready(port)
+        return self
+
+    def _wait_ready(self, port):
+        deadline = time.monotonic() + self.args.startup_timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise SystemExit(f"server exited with status {self.proc.returncode}:\n{self.log_tail()}")
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+                conn.request('GET', '/api/catalog/stats')
+                if conn.getresponse().status == 200:
+                    conn.close()
+                    return
+                conn.close()
+            except OSError:
+                pass
+            time.sleep(0.25)
+        raise SystemExit(f"server not ready after {self.args.startup_timeout}s:\n{self.log_tail()}")
+
+    def log_tail(self, lines=20):
+        with open(os.path.join(self.tmpdir.name, 'server.log')) as f:
+            return ''.join(f.readlines()[-lines:])
+
+    def __exit__(self, *exc):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        self.tmpdir.cleanup()
+
+
+def check_slo(result, p99_ms, max_error_rate):
+    """Names of the endpoints (and what) that broke the budget."""
+    failures = []
+    for endpoint, s in result['endpoints'].items():
+        if p99_ms is not None and s['p99_ms'] is not None and s['p99_ms'] > p99_ms:
+            failures.append(f"{endpoint}.p99_ms {s['p99_ms']} > {p99_ms}")
+        if s['error_rate'] > max_error_rate:
+            failures.append(f"{endpoint}.error_rate {s['error_rate']} > {max_error_rate}")
+    return failures
+
+
+def report(result):
+    log(f"{'endpoint':<10} {'n':>8} {'req/s':>9} {'errors':>8} {'p50 ms':>9} {'p90 ms':>9} "
+        f"{'p99 ms':>9} {'max ms':>9}")
+    for endpoint, s in result['endpoints'].items():
+        if not s['n']:
+            continue
+        log(f"{endpoint:<10} {s['n']:>8} {s['throughput_rps']:>9.1f} {s['error_rate']:>8.2%} {s['p50_ms']:>9.2f} "
+            f"{s['p90_ms']:>9.2f} {s['p99_ms']:>9.2f} {s['max_ms']:>9.2f}")
+    for endpoint, s in result['endpoints'].items():
+        if not s['n']:
+            continue
+        log(f"\n{endpoint} latency histogram")
+        peak = max(s['histogram'].values())
+        for bucket, count in s['histogram'].items():
+            if count:
+                log(f"  {bucket:>12} {count:>8} {'#' * max(1, round(40 * count / peak))}")
+        if s['error_kinds']:
+            log(f"  errors: {', '.join(f'{k}={v}' for k, v in sorted(s['error_kinds'].items()))}")
+
+
+def run(args):
+    names = ingredient_ranking(args.db)
+    pantries = PantryDistribution(names, args.pantry_size, args.zipf)
+    recorder = Recorder()
+    if args.url:
+        elapsed = run_load(args, args.url, pantries, recorder)
+    else:
+        with LocalServer(args) as server:
+            log(f"server up at {server.url} ({args.workers} workers, engine {args.engine})")
+            elapsed = run_load(args, server.url, pantries, recorder)
+    endpoints = {e: recorder.summary(e, elapsed) for e in args.mix}
+    total = sum(s['n'] for s in endpoints.values())
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'url': args.url or 'local',
+            'workers': None if args.url else args.workers,
+            'engine': None if args.url else args.engine,
+            'concurrency': args.concurrency,
+            'rps': args.rps,
+            'duration_s': args.duration,
+            'warmup_s': args.warmup,
+            'mix': args.mix,
+            'pantry_size': list(args.pantry_size),
+            'zipf_s': args.zipf,
+            'catalog_ingredients': len(names),
+        },
+        'total': {
+            'n': total,
+            'throughput_rps': round(total / elapsed, 2) if elapsed else None,
+            'errors': sum(s['errors'] for s in endpoints.values()),
+        },
+        'endpoints': endpoints,
+    }
+
+
+def log(msg):
+    print(msg, file=sys.stderr)
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Load / soak test the recipe API and gate on a p99 latency budget.")
+    p.add_argument('--url', default=None, help="test this running server instead of starting serve.py locally")
+    p.add_argument('--db', default=DB_PATH, help="catalog to serve and to draw pantries from (default data/recipes.db)")
+    p.add_argument('--workers', type=int, default=2, help="serve.py worker processes (default 2)")
+    p.add_argument('--engine', choices=('python', 'vector'), default='python', help="MATCHER_ENGINE of the server")
+    p.add_argument('--server-env', action='append', default=[], metavar='KEY=VALUE',
+                   help="extra environment for the started server, e.g. SUGGEST_CACHE_ENTRIES=0 (repeatable)")
+    p.add_argument('--startup-timeout', type=float, default=300.0)
+    p.add_argument('--concurrency', type=int, default=8, help="client connections (default 8)")
+    p.add_argument('--rps', type=float, default=50.0, help="target request rate; 0 = closed loop, as fast as possible")
+    p.add_argument('--duration', type=float, default=30.0, help="measured seconds (default 30)")
+    p.add_argument('--warmup', type=float, default=5.0, help="seconds of load before measuring (default 5)")
+    p.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                   help=f"endpoint weights, from {', '.join(ENDPOINTS)} (default {DEFAULT_MIX})")
+    p.add_argument('--pantry-size', type=int, nargs=2, default=(3, 12), metavar=('MIN', 'MAX'))
+    p.add_argument('--zipf', type=float, default=1.1, help="Zipf exponent over ingredient popularity rank (default 1.1)")
+    p.add_argument('--max-results', type=int, default=20)
+    p.add_argument('--timeout', type=float, default=30.0, help="per-request socket timeout in seconds")
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--report-every', type=float, default=10.0, help="seconds between progress lines (0 disables)")
+    p.add_argument('--p99-ms', type=float, default=None, help="fail if any endpoint's p99 latency exceeds this")
+    p.add_argument('--max-error-rate', type=float, default=0.001,
+                   help="fail if any endpoint's error rate exceeds this (default 0.001)")
+    p.add_argument('--out', default=None, help="write results as JSON to this file ('-' for stdout)")
+    args = p.parse_args(argv)
+    if args.concurrency < 1 or args.workers < 1:
+        p.error("--concurrency and --workers must be at least 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run(args)
+    report(result)
+    if args.out == '-':
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    elif args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+        log(f"results written to {args.out}")
+    failures = check_slo(result, args.p99_ms, args.max_error_rate)
+    if failures:
+        log("SLO failed: " + '; '.join(failures))
+        return 1
+    log(f"{result['total']['n']} requests, {result['total']['throughput_rps']} req/s, SLO met")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
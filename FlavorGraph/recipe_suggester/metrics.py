@@ -0,0 +1,189 @@
+# metrics.py
+"""
+Request instrumentation: per-stage timers, counters and sampled cProfile runs,
+rendered in Prometheus text exposition format for /metrics.
+"""
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+
+# latency histogram buckets in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class StageTimer:
+    """
+    Splits one request into consecutive named stages: lap(stage) charges the time since
+    the previous lap to stage. counts holds work done by the request (recipes scanned, ...).
+    """
+    __slots__ = ('start', 'last', 'stages', 'counts')
+
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.stages = {}
+        self.counts = {}
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + (now - self.last)
+        self.last = now
+
+    def total(self):
+        return self.last - self.start
+
+    def as_dict(self):
+        return {
+            'total_ms': round(self.total() * 1000.0, 3),
+            'stages_ms': {stage: round(s * 1000.0, 3) for stage, s in self.stages.items()},
+            'counts': dict(self.counts),
+        }
+
+
+class Metrics:
+    """
+    Process-wide counters, gauges and histograms. Names are given without the prefix;
+    labels are a dict. Collectors registered with add_collector are called at render
+    time and return [(name, type, value, labels)] for values owned by other objects.
+    """
+
+    def __init__(self, prefix='flavorgraph', buckets=DEFAULT_BUCKETS, profile_rate=0.0, profile_limit=40):
+        """profile_rate: fraction of maybe_profile() calls that return a running profiler"""
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self.profile_rate = profile_rate
+        self.profile_limit = profile_limit
+        self._lock = threading.Lock()
+        self._help = {}
+        self._types = {}
+        self._counters = {}     # (name, labels) -> value
+        self._gauges = {}
+        self._histograms = {}   # (name, labels) -> [bucket counts..., sum, count]
+        self._collectors = []
+        # cProfile allows one active profiler at a time, so samples never overlap
+        self._profile_lock = threading.Lock()
+        self._profile_stats = None
+        self.profiles_sampled = 0
+
+    def describe(self, name, kind, help_text):
+        self._types[name] = kind
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, labels=None):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, labels=None):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, seconds, labels=None):
+        key = (name, _label_key(labels))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    h[i] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        """Everything in Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {k: list(v) for k, v in self._histograms.items()}
+        for collector in self._collectors:
+            for name, kind, value, labels in collector():
+                (counters if kind == 'counter' else gauges)[(name, _label_key(labels))] = value
+
+        families = {}
+        for (name, labels), value in counters.items():
+            families.setdefault(name, ('counter', []))[1].append((name, labels, value))
+        for (name, labels), value in gauges.items():
+            families.setdefault(name, ('gauge', []))[1].append((name, labels, value))
+        for (name, labels), h in histograms.items():
+            samples = families.setdefault(name, ('histogram', []))[1]
+            for bound, n in zip(self.buckets, h):
+                samples.append((name + '_bucket', labels + (('le', _fmt(bound)),), n))
+            samples.append((name + '_bucket', labels + (('le', '+Inf'),), h[-1]))
+            samples.append((name + '_sum', labels, h[-2]))
+            samples.append((name + '_count', labels, h[-1]))
+
+        lines = []
+        for name in sorted(families):
+            kind, samples = families[name]
+            full = f"{self.prefix}_{name}"
+            if name in self._help:
+                lines.append(f"# HELP {full} {self._help[name]}")
+            lines.append(f"# TYPE {full} {self._types.get(name, kind)}")
+            for sample, labels, value in samples:
+                lines.append(f"{self.prefix}_{sample}{_fmt_labels(labels)} {_fmt(value)}")
+        return '\n'.join(lines) + '\n'
+
+    # --- sampled profiling ---
+
+    def maybe_profile(self):
+        """A started cProfile.Profile for a sampled fraction of calls, else None."""
+        if self.profile_rate <= 0 or random.random() >= self.profile_rate:
+            return None
+        if not self._profile_lock.acquire(blocking=False):
+            return None
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:  # another profiler (debugger, coverage) is active
+            self._profile_lock.release()
+            return None
+        return prof
+
+    def finish_profile(self, prof):
+        """Stop a profile from maybe_profile and fold it into the aggregate report."""
+        if prof is None:
+            return
+        prof.disable()
+        try:
+            with self._lock:
+                if self._profile_stats is None:
+                    self._profile_stats = pstats.Stats(prof, stream=io.StringIO())
+                else:
+                    self._profile_stats.add(prof)
+                self.profiles_sampled += 1
+        finally:
+            self._profile_lock.release()
+
+    def profile_report(self, sort='cumulative', limit=None):
+        """Aggregated pstats text of all sampled requests so far."""
+        with self._lock:
+            if self._profile_stats is None:
+                return "no profiles sampled yet (set a profile rate above 0)\n"
+            out = io.StringIO()
+            self._profile_stats.stream = out
+            out.write(f"{self.profiles_sampled} sampled requests\n")
+            self._profile_stats.sort_stats(sort).print_stats(limit or self.profile_limit)
+            return out.getvalue()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _fmt_labels(labels):
+    if not labels:
+        return ''
+    body = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+    return '{' + body + '}'
+
+
+def _fmt(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
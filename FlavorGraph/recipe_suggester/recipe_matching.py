@@ -1,132 +1,643 @@
 # recipe_matching.py
 import sqlite3
 import os
+import json
+import base64
+import logging
+import threading
+import heapq
+from array import array
 from substitution import SubstitutionEngine
-from collections import defaultdict
-import math
+from catalog_stats import CatalogStats
+from vocab import IngredientVocab
+from db import pool_for, _file_id
+from schema import catalog_generation
+from metrics import StageTimer
+from collections import Counter, defaultdict
+
+logger = logging.getLogger(__name__)
+
+_EMPTY = ()
+
+class CatalogSnapshot:
+    """
+    The in-memory catalog indexes used for scoring.
+    Ingredients are vocabulary ids (see IngredientVocab) and every per-recipe or
+    per-ingredient list is a sorted array('i'). A snapshot is never modified once
+    published: reloads build a new one and swap it in with a single assignment,
+    so a request that grabbed a snapshot keeps a consistent view until it finishes.
+    """
+
+    def __init__(self, vocab):
+        self.vocab = vocab
+        self.recipes = {}
+        self.req_ings = {}                # recipe id -> ingredient ids
+        self.opt_ings = {}
+        self.ingredient_popularity = {}   # ingredient id -> how many recipes use it
+        # inverted index: ingredient id -> ids of recipes using it (required or optional / required only)
+        self.postings = {}
+        self.req_postings = {}
+        self.required_counts = {}
+        self.always_candidates = []
+        # reverse substitution index: pantry ingredient id -> recipe ingredient ids it can stand in for
+        self.substitutes_for = {}
+        self.subst = None
+        self.stats = None
+        self.vector = None
+        # python engine: VectorScorer that shopping plans build on first use (see _gap_scorer)
+        self.gap_scorer = None
+
+    def copy(self):
+        """Shallow copy; the arrays are shared, so replace them rather than mutate them."""
+        snap = CatalogSnapshot(self.vocab)
+        snap.recipes = dict(self.recipes)
+        snap.req_ings = dict(self.req_ings)
+        snap.opt_ings = dict(self.opt_ings)
+        snap.ingredient_popularity = dict(self.ingredient_popularity)
+        snap.postings = dict(self.postings)
+        snap.req_postings = dict(self.req_postings)
+        snap.subst = self.subst
+        snap.stats = self.stats
+        return snap
+
+def _snapshot_attr(name):
+    # read-only shortcut onto the current snapshot
+    return property(lambda self: getattr(self.snapshot, name))
 
 class RecipeMatcher:
-    def __init__(self, db_path='data/recipes.db'):
+    # how many substitutes are considered per missing ingredient
+    SUBST_LIMIT = 6
+    ENGINES = ('python', 'vector')
+    # pantries scored together per pass by suggest_batch
+    BATCH_CHUNK = 32
+    # distinct pantries whose results suggest_batch keeps around for reuse
+    BATCH_MEMO = 10000
+
+    recipes = _snapshot_attr('recipes')
+    req_ings = _snapshot_attr('req_ings')
+    opt_ings = _snapshot_attr('opt_ings')
+    ingredient_popularity = _snapshot_attr('ingredient_popularity')
+    postings = _snapshot_attr('postings')
+    req_postings = _snapshot_attr('req_postings')
+    substitutes_for = _snapshot_attr('substitutes_for')
+    subst = _snapshot_attr('subst')
+    stats = _snapshot_attr('stats')
+    vector = _snapshot_attr('vector')
+    vocab = _snapshot_attr('vocab')
+
+    def __init__(self, db_path='data/recipes.db', engine='python', result_cache=None, snapshot_path=None,
+                 index_path=None, metrics=None, ranking_cache=None):
+        """
+        engine: 'python' scores candidates one by one; 'vector' scores the whole catalog
+                with sparse matrix products (needs numpy + scipy) and returns identical rankings
+        result_cache: optional ResultCache consulted by suggest (invalidated on catalog reload)
+        snapshot_path: serve from a binary snapshot file (see snapshot_file.py) mapped read-only
+                       instead of loading recipes.db; reloads re-map the file when it is replaced
+        index_path: on-disk index cache (same format) mapped at startup when it was built from the
+                    current recipes.db, and rebuilt + rewritten when it is missing or stale
+        metrics: optional Metrics registry that suggest reports stage timings and counts to
+        ranking_cache: optional ResultCache of full rankings (recipe id arrays) that suggest_page
+                       serves later pages from
+        """
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown scoring engine {engine!r}; expected one of {self.ENGINES}")
         self.db_path = os.path.abspath(db_path)
+        self.snapshot_path = os.path.abspath(snapshot_path) if snapshot_path else None
+        self.index_path = os.path.abspath(index_path) if index_path else None
+        self.engine = engine
+        self.cache = result_cache
+        self.rankings = ranking_cache
+        self.metrics = metrics
+        if metrics is not None:
+            self._describe_metrics(metrics)
+        self._reload_lock = threading.Lock()
+        self._gap_lock = threading.Lock()
+        self._watcher = None
+        if self.snapshot_path:
+            self._db_sig = self._db_signature()
+            self._change_id = None
+            self.snapshot = self._map_snapshot(self.snapshot_path, 1)
+            return
         if not os.path.exists(self.db_path):
             raise FileNotFoundError(f"SQLite DB not found at: {self.db_path}")
-        # test connection
-        conn = sqlite3.connect(self.db_path)
-        conn.execute("PRAGMA foreign_keys = ON;")
-        conn.close()
-        # load graph
-        self._load_graph()
-        self.subst = SubstitutionEngine(self.db_path)
+        self.db = pool_for(self.db_path)
+        # load graph; the connection is opened before the signature is taken because opening
+        # a WAL database can create its -wal file
+        conn = self._conn()
+        self._db_sig = self._db_signature()
+        self._db_id = _file_id(self.db_path)
+        self.snapshot = None
+        try:
+            # one read transaction, shared with the SubstitutionEngine load on this thread's connection
+            conn.execute('BEGIN')
+            self._change_id = self._last_change_id(conn)
+            self._generation = catalog_generation(conn)
+            if self.index_path:
+                fingerprint = self.index_fingerprint(conn, self._db_sig, self._change_id)
+                self.snapshot = self._load_index(fingerprint)
+            if self.snapshot is None:
+                self.snapshot = self._build_snapshot(conn, vocab=IngredientVocab())
+        finally:
+            conn.execute('COMMIT')
+        if self.index_path and isinstance(self.snapshot, CatalogSnapshot):
+            self._save_index(fingerprint)
 
     def _conn(self):
-        return sqlite3.connect(self.db_path)
+        return self.db.connection()
 
-    def _load_graph(self):
-        self.recipes = {}
-        self.req_ings = defaultdict(set)
-        self.opt_ings = defaultdict(set)
-        self.ingredient_popularity = defaultdict(int)  # how many recipes use an ingredient
+    def _build_snapshot(self, conn, version=1, vocab=None):
+        # ingredient ids stay stable across reloads, so later snapshots keep interning into one vocab
+        snap = CatalogSnapshot(vocab if vocab is not None else self.snapshot.vocab)
+        snap.subst = SubstitutionEngine(self.db_path, vocab=snap.vocab, metrics=self.metrics)
+        self._load_graph(conn, snap)
+        self._finish_snapshot(snap, version)
+        return snap
 
-        conn = self._conn()
+    def _load_graph(self, conn, snap):
         cur = conn.cursor()
-        cur.execute('SELECT id, name, cuisine, servings FROM recipes')
+        cur.execute('SELECT id, name, cuisine, servings FROM recipes ORDER BY id')
         for r_id, name, cuisine, servings in cur.fetchall():
-            self.recipes[r_id] = {'id': r_id, 'name': name, 'cuisine': cuisine, 'servings': servings}
+            snap.recipes[r_id] = {'id': r_id, 'name': name, 'cuisine': cuisine, 'servings': servings}
 
+        # CROSS JOIN keeps SQLite scanning recipe_ingredients in table order; with the
+        # ingredient_id index present it would otherwise drive the join from ingredients
         cur.execute('''SELECT ri.recipe_id, lower(i.name), ri.optional
                        FROM recipe_ingredients ri
-                       JOIN ingredients i ON i.id = ri.ingredient_id''')
-        for recipe_id, ing_name, optional in cur.fetchall():
-            ing_name = ing_name.lower()
-            if optional:
-                self.opt_ings[recipe_id].add(ing_name)
+                       CROSS JOIN ingredients i ON i.id = ri.ingredient_id''')
+        req, opt = self._read_links(snap.vocab, cur.fetchall(), snap.recipes)
+
+        post, req_post = defaultdict(list), defaultdict(list)
+        # recipes in id order, so posting lists come out sorted
+        for r_id in snap.recipes:
+            self._add_recipe_links(snap, r_id, req.get(r_id, set()), opt.get(r_id, set()), post, req_post)
+        snap.postings = {i: array('i', ids) for i, ids in post.items()}
+        snap.req_postings = {i: array('i', ids) for i, ids in req_post.items()}
+
+    def _read_links(self, vocab, rows, recipes):
+        # (recipe_id, ingredient name, optional) rows -> required / optional ingredient id sets per recipe
+        req, opt = defaultdict(set), defaultdict(set)
+        for recipe_id, ing_name, optional in rows:
+            if recipe_id not in recipes:
+                continue  # link to a deleted recipe
+            (opt if optional else req)[recipe_id].add(vocab.intern(ing_name.lower()))
+        return req, opt
+
+    def _add_recipe_links(self, snap, r_id, req, opt, post, req_post):
+        if req:
+            snap.req_ings[r_id] = array('i', sorted(req))
+        if opt:
+            snap.opt_ings[r_id] = array('i', sorted(opt))
+        for i in req:
+            req_post[i].append(r_id)
+        for i in req | opt:
+            post[i].append(r_id)
+        popularity = snap.ingredient_popularity
+        for ids in (req, opt):
+            for i in ids:
+                popularity[i] = popularity.get(i, 0) + 1
+
+    def _finish_snapshot(self, snap, version):
+        # indexes derived from the recipe graph as a whole
+        snap.required_counts = {r_id: len(snap.req_ings.get(r_id, _EMPTY)) for r_id in snap.recipes}
+        # recipes without required ingredients fully match any pantry, so they are always candidates
+        snap.always_candidates = [r_id for r_id, n in snap.required_counts.items() if n == 0]
+        snap.stats = CatalogStats(version, snap.vocab, snap.recipes, snap.req_ings, snap.opt_ings,
+                                  snap.ingredient_popularity)
+        self._load_subst_index(snap)
+        self._attach_engine(snap)
+
+    def _attach_engine(self, snap):
+        if self.engine == 'vector':
+            from vector_scoring import VectorScorer
+            snap.vector = VectorScorer(snap, self.SUBST_LIMIT)
+
+    def _map_snapshot(self, path, version):
+        from snapshot_file import MappedSnapshot
+        snap = MappedSnapshot(path, version)
+        if snap.subst.limit != self.SUBST_LIMIT:
+            raise ValueError(f"{path} was built with substitute limit {snap.subst.limit}, "
+                             f"matcher uses {self.SUBST_LIMIT}")
+        self._attach_engine(snap)
+        return snap
+
+    # --- on-disk index cache ---
+
+    @classmethod
+    def db_fingerprint(cls, db_path):
+        """index_fingerprint of db_path as it is right now."""
+        db_path = os.path.abspath(db_path)
+        conn = pool_for(db_path).connection()
+        sig = _file_signature([db_path, db_path + '-wal'])
+        conn.execute('BEGIN')
+        try:
+            return cls.index_fingerprint(conn, sig, cls._last_change_id(conn))
+        finally:
+            conn.execute('COMMIT')
+
+    @classmethod
+    def index_fingerprint(cls, conn, sig, change_id):
+        """
+        What an index file must have been built from to be reused. With a catalog_changes log
+        every catalog write moves change_id, and the generation id tells a re-created catalog
+        from the old one whose log restarted, so (generation, schema, change_id, recipe count/max id)
+        is exact; without both the size + mtime of the DB files stand in for a content checksum.
+        """
+        from snapshot_file import FORMAT_VERSION
+        recipes = conn.execute('SELECT COUNT(*), MAX(id) FROM recipes').fetchone()
+        generation = catalog_generation(conn)
+        fingerprint = {
+            'format': FORMAT_VERSION,
+            'subst_limit': cls.SUBST_LIMIT,
+            'schema_version': conn.execute('PRAGMA schema_version').fetchone()[0],
+            'generation': generation,
+            'change_id': change_id,
+            'recipes': recipes,
+            'db': sig if change_id is None or generation is None else None,
+        }
+        # normalised through JSON so it compares equal to the copy read back from a header
+        return json.loads(json.dumps(fingerprint))
+
+    def _load_index(self, fingerprint):
+        from snapshot_file import read_header
+        try:
+            if read_header(self.index_path).get('fingerprint') != fingerprint:
+                logger.info("Index cache %s is stale; rebuilding", self.index_path)
+                return None
+            return self._map_snapshot(self.index_path, 1)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Ignoring unreadable index cache %s: %s", self.index_path, e)
+            return None
+
+    def _save_index(self, fingerprint):
+        # a read-only deploy directory shouldn't stop the server from starting
+        try:
+            self.save_snapshot(self.index_path, meta={'fingerprint': fingerprint})
+        except Exception as e:
+            logger.warning("Could not write index cache %s: %s", self.index_path, e)
+
+    def save_snapshot(self, path, meta=None):
+        """Write the current catalog as a binary snapshot file for RecipeMatcher(snapshot_path=...)."""
+        from snapshot_file import write_snapshot
+        return write_snapshot(self.snapshot, path, self.SUBST_LIMIT, meta)
+
+    def catalog_stats(self):
+        """Summary of the loaded catalog (version, sizes, most popular ingredients)."""
+        return self.stats.summary()
+
+    def _load_subst_index(self, snap):
+        # zero-score substitutes are never chosen by suggest, so they are left out
+        substitutes_for = defaultdict(set)
+        for ing in snap.req_postings:
+            for sub, score, reason in snap.subst.find_substitute_ids(ing, limit=self.SUBST_LIMIT):
+                if score > 0:
+                    substitutes_for[sub].add(ing)
+        snap.substitutes_for = dict(substitutes_for)
+
+    # --- hot reload ---
+
+    def _db_signature(self):
+        # size + mtime of the database and its WAL (or of the snapshot file); any committed write changes one of them
+        if self.snapshot_path:
+            return _file_signature([self.snapshot_path])
+        return _file_signature([self.db_path, self.db_path + '-wal'])
+
+    @staticmethod
+    def _last_change_id(conn):
+        """High-water mark of the catalog_changes log, or None if the DB has no change log."""
+        try:
+            return conn.execute('SELECT COALESCE(MAX(id), 0) FROM catalog_changes').fetchone()[0]
+        except sqlite3.OperationalError:
+            return None
+
+    def reload_if_changed(self):
+        """Reload the catalog if recipes.db was written since the last load; returns True if it was."""
+        if self._db_signature() == self._db_sig:
+            return False
+        return self.reload()
+
+    def reload(self, full=False):
+        """
+        Bring the in-memory catalog up to date with recipes.db.
+        With a catalog_changes log only the recipes (and, if needed, the substitution graph)
+        named in new log entries are re-read; without one, or with full=True, everything is.
+        A matcher serving a snapshot file re-maps it instead.
+        The new snapshot is swapped in atomically. Returns True if a new snapshot was published.
+        """
+        if self.snapshot_path:
+            return self._remap(full)
+        with self._reload_lock:
+            conn = self._conn()
+            sig = self._db_signature()
+            db_id = _file_id(self.db_path)
+            old = self.snapshot
+            try:
+                # one read transaction so the change log and the rows it points at agree
+                conn.execute('BEGIN')
+                change_id = self._last_change_id(conn)
+                generation = catalog_generation(conn)
+                # a catalog mapped from the index cache can't be patched in place, so it is rebuilt;
+                # so is one whose log went backwards or that was re-created (a re-seeded DB)
+                if (full or change_id is None or self._change_id is None or change_id < self._change_id
+                        or db_id != self._db_id or generation != self._generation
+                        or not isinstance(old, CatalogSnapshot)):
+                    snap = self._build_snapshot(conn, old.stats.version + 1)
+                elif change_id == self._change_id:
+                    snap = None
+                else:
+                    snap = self._apply_changes(conn, old, self._change_id, change_id)
+                fingerprint = self.index_fingerprint(conn, sig, change_id) if self.index_path else None
+            finally:
+                conn.execute('COMMIT')
+            self._db_sig = sig
+            self._db_id = db_id
+            self._generation = generation
+            self._change_id = change_id
+            if snap is None:
+                return False
+            self.snapshot = snap
+            logger.info("Catalog reloaded: version %s, %d recipes", snap.stats.version, len(snap.recipes))
+            if self.index_path:
+                self._save_index(fingerprint)
+            return True
+
+    def _remap(self, full=False):
+        with self._reload_lock:
+            sig = self._db_signature()
+            if sig == self._db_sig and not full:
+                return False
+            snap = self._map_snapshot(self.snapshot_path, self.snapshot.stats.version + 1)
+            self._db_sig = sig
+            self.snapshot = snap
+            logger.info("Catalog snapshot re-mapped: version %s, %d recipes", snap.stats.version, len(snap.recipes))
+            return True
+
+    def _apply_changes(self, conn, old, since_id, until_id):
+        cur = conn.cursor()
+        cur.execute('''SELECT DISTINCT entity, entity_id FROM catalog_changes
+                       WHERE id > ? AND id <= ?''', (since_id, until_id))
+        changes = cur.fetchall()
+        # bulk loads log one 'catalog' entry instead of every row they wrote
+        if any(entity == 'catalog' for entity, _ in changes):
+            return self._build_snapshot(conn, old.stats.version + 1)
+        dirty = set()
+        subst_dirty = False
+        changed_ings = []
+        for entity, entity_id in changes:
+            if entity == 'recipe':
+                dirty.add(entity_id)
             else:
-                self.req_ings[recipe_id].add(ing_name)
-            self.ingredient_popularity[ing_name] += 1
+                subst_dirty = True
+                if entity == 'ingredient':
+                    changed_ings.append(entity_id)
+        # a renamed ingredient changes every recipe that uses it
+        for chunk in _chunks(changed_ings):
+            cur.execute(f'''SELECT DISTINCT recipe_id FROM recipe_ingredients
+                            WHERE ingredient_id IN ({",".join("?" * len(chunk))})''', chunk)
+            dirty.update(r for (r,) in cur.fetchall())
+
+        snap = old.copy()
+        # ingredient id -> ([recipe ids removed], [recipe ids added]) for both posting indexes
+        post_delta = defaultdict(lambda: (set(), set()))
+        req_delta = defaultdict(lambda: (set(), set()))
+
+        # drop the old version of every dirty recipe...
+        popularity = snap.ingredient_popularity
+        for r_id in dirty:
+            old_req = set(old.req_ings.get(r_id, _EMPTY))
+            old_opt = set(old.opt_ings.get(r_id, _EMPTY))
+            for i in old_req:
+                req_delta[i][0].add(r_id)
+            for i in old_req | old_opt:
+                post_delta[i][0].add(r_id)
+            for ids in (old_req, old_opt):
+                for i in ids:
+                    popularity[i] -= 1
+            snap.req_ings.pop(r_id, None)
+            snap.opt_ings.pop(r_id, None)
+
+        # ...and read back whatever still exists
+        max_before = max(old.recipes) if old.recipes else 0
+        reorder = False
+        seen = {}
+        rows = []
+        for chunk in _chunks(sorted(dirty)):
+            marks = ",".join("?" * len(chunk))
+            cur.execute(f'SELECT id, name, cuisine, servings FROM recipes WHERE id IN ({marks}) ORDER BY id', chunk)
+            for r_id, name, cuisine, servings in cur.fetchall():
+                seen[r_id] = {'id': r_id, 'name': name, 'cuisine': cuisine, 'servings': servings}
+                reorder = reorder or (r_id not in old.recipes and r_id < max_before)
+            cur.execute(f'''SELECT ri.recipe_id, lower(i.name), ri.optional
+                            FROM recipe_ingredients ri
+                            JOIN ingredients i ON i.id = ri.ingredient_id
+                            WHERE ri.recipe_id IN ({marks})''', chunk)
+            rows.extend(cur.fetchall())
+        req, opt = self._read_links(snap.vocab, rows, seen)
+        post_add, req_add = defaultdict(list), defaultdict(list)
+        for r_id, recipe in seen.items():
+            snap.recipes[r_id] = recipe
+            self._add_recipe_links(snap, r_id, req.get(r_id, set()), opt.get(r_id, set()), post_add, req_add)
+        for i, ids in post_add.items():
+            post_delta[i][1].update(ids)
+        for i, ids in req_add.items():
+            req_delta[i][1].update(ids)
+        for r_id in dirty - seen.keys():
+            snap.recipes.pop(r_id, None)
+
+        # rebuild only the touched posting arrays (copy-on-write: the old snapshot may still be serving)
+        for index, delta in ((snap.postings, post_delta), (snap.req_postings, req_delta)):
+            for i, (removed, added) in delta.items():
+                ids = (set(index.get(i, _EMPTY)) - removed) | added
+                if ids:
+                    index[i] = array('i', sorted(ids))
+                else:
+                    index.pop(i, None)
+
+        # keep the indexes identical to a full load: no empty entries, catalog in id order
+        for i in [i for i, n in popularity.items() if n <= 0]:
+            del popularity[i]
+        if reorder:
+            snap.recipes = dict(sorted(snap.recipes.items()))
+
+        if subst_dirty:
+            snap.subst = SubstitutionEngine(self.db_path, vocab=snap.vocab, metrics=self.metrics)
+        self._finish_snapshot(snap, old.stats.version + 1)
+        return snap
+
+    def start_watcher(self, interval=5.0):
+        """Poll recipes.db every interval seconds in a daemon thread and hot-reload on change."""
+        if self._watcher is not None:
+            return self._watcher
+        stop = threading.Event()
+
+        def watch():
+            while not stop.wait(interval):
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    logger.exception("Catalog reload failed: %s", e)
 
-        conn.close()
+        self._watcher = threading.Thread(target=watch, name='catalog-watcher', daemon=True)
+        self._watcher.stop = stop
+        self._watcher.start()
+        return self._watcher
 
-    def suggest(self, user_ingredients, max_results=20, allow_subst=True):
+    def stop_watcher(self):
+        if self._watcher is not None:
+            self._watcher.stop.set()
+            self._watcher = None
+
+    # --- scoring ---
+
+    def _candidates(self, snap, S, allow_subst=True, include_zero_overlap=False):
+        """
+        Recipe ids worth scoring for pantry S, in catalog order.
+        Only recipes sharing an ingredient with S (or a required ingredient S can substitute)
+        can score above zero; include_zero_overlap returns the whole catalog for browsing.
+        """
+        if include_zero_overlap:
+            return list(snap.recipes)
+        cand = set(snap.always_candidates)
+        for ing in S:
+            cand.update(snap.postings.get(ing, _EMPTY))
+            if allow_subst:
+                for orig in snap.substitutes_for.get(ing, _EMPTY):
+                    cand.update(snap.req_postings.get(orig, _EMPTY))
+        return sorted(cand)
+
+    def suggest(self, user_ingredients, max_results=20, allow_subst=True, include_zero_overlap=False,
+                timing=None):
         """
         user_ingredients: list of ingredient names (strings)
         allow_subst: bool - whether to attempt substitutes
+        include_zero_overlap: bool - also rank recipes sharing nothing with the pantry (browse mode)
+        timing: optional dict, filled with this call's per-stage milliseconds and work counts
         """
-        S = set([u.strip().lower() for u in (user_ingredients or [])])
-        candidates = []
-
-        # Precompute rarity boost: ingredients that appear in fewer recipes are rarer -> positive boost if present
-        # rarity_score(ing) = 1 / (1 + log(1 + popularity))
-        rarity_score = {}
-        for ing, pop in self.ingredient_popularity.items():
-            rarity_score[ing] = 1.0 / (1.0 + math.log(1 + pop))
-
-        for r_id, recipe in self.recipes.items():
-            required = set(self.req_ings.get(r_id, set()))
-            optional = set(self.opt_ings.get(r_id, set()))
-            missing = required - S
-            optional_missing = optional - S
-
-            subst_plan = {}
-            covered_by_subst = 0
-
-            if allow_subst and missing:
-                # try to cover each missing ingredient with substitutes
-                for m in list(missing):
-                    subs = self.subst.find_substitutes(m, limit=6)
-                    # prefer substitutes present in S
-                    chosen = None
-                    chosen_score = 0.0
-                    chosen_reason = None
-                    for name, score, reason in subs:
-                        if name in S:
-                            # choose best substitute present in pantry
-                            if score > chosen_score:
-                                chosen = name
-                                chosen_score = score
-                                chosen_reason = reason
-                    if chosen:
-                        covered_by_subst += 1
-                        subst_plan[m] = {'substitute': chosen, 'score': chosen_score, 'reason': chosen_reason}
-
-            missing_after_subst = set([m for m in missing if m not in subst_plan])
-            req_count = max(1, len(required))
-            # match fraction after substitution
-            matched = req_count - len(missing_after_subst)
-            match_fraction = matched / req_count
-
-            # substitution coverage fraction
-            subst_fraction = covered_by_subst / req_count
-
-            # optional penalty
-            optional_penalty = len(optional_missing) / max(1, len(optional) + 1)
-
-            # rarity bonus: if user has rare ingredients required by recipe, bump score a bit
-            rarity_bonus = 0.0
-            for ing in required & S:
-                rarity_bonus += 0.05 * rarity_score.get(ing, 0.2)  # small additive bonus
-
-            # final score (weighted)
-            score = (0.7 * match_fraction) + (0.18 * subst_fraction) + (0.02 * rarity_bonus) - (0.04 * optional_penalty)
-
-            # normalize score into 0..1
-            score = max(0.0, min(1.0, score))
-
-            # additional metadata for ranking: fewer total required ingredients preferred if scores close
-            candidates.append({
-                'score': score,
-                'r_id': r_id,
-                'missing_after_subst': sorted(list(missing_after_subst)),
-                'substitution_plan': subst_plan,
-                'required_count': req_count,
-                'matched_count': matched
-            })
+        prof = self.metrics.maybe_profile() if self.metrics is not None else None
+        try:
+            timer = StageTimer()
+            out = self._suggest(timer, user_ingredients, max_results, allow_subst, include_zero_overlap)
+        finally:
+            if prof is not None:
+                self.metrics.finish_profile(prof)
+        self._record(timer, timing)
+        return out
+
+    def _suggest(self, timer, user_ingredients, max_results, allow_subst, include_zero_overlap):
+        snap = self.snapshot
+        S = self._normalize(snap, user_ingredients)  # ingredient ids
+        timer.lap('normalize')
+        if self.cache is not None:
+            # results are shared between callers with the same key; treat them as read-only
+            key = (tuple(sorted(S)), max_results, allow_subst, include_zero_overlap)
+            out = self.cache.get(key, snap.stats.version)
+            timer.lap('cache')
+            if out is not None:
+                timer.counts['cache_hit'] = 1
+                return out
 
-        # sort by score desc, tiebreaker: fewer missing after subst, more matched, fewer required_count
-        candidates.sort(key=lambda x: (x['score'], -x['matched_count'], -x['required_count']), reverse=True)
+        if snap.vector is not None:
+            # vector engine narrows the catalog to a shortlist that is rescored exactly below
+            r_ids = snap.vector.shortlist(S, max_results, allow_subst, include_zero_overlap)
+        else:
+            r_ids = self._candidates(snap, S, allow_subst, include_zero_overlap)
+        timer.lap('candidates')
+        out = self._rank(snap, S, r_ids, max_results, allow_subst, timer)
 
+        if self.cache is not None:
+            self.cache.put(key, out, snap.stats.version)
+            timer.lap('cache')
+        return out
+
+    # stage names are fixed, so the per-stage histograms have a bounded label set
+    def _describe_metrics(self, metrics):
+        metrics.describe('suggest_seconds', 'histogram', "Time spent in RecipeMatcher.suggest.")
+        metrics.describe('suggest_stage_seconds', 'histogram',
+                         "Time per suggest stage (normalize, cache, candidates, substitute, score, select, detail).")
+        metrics.describe('suggest_requests_total', 'counter', "suggest calls.")
+        metrics.describe('suggest_cache_hits_total', 'counter', "suggest calls answered from the result cache.")
+        metrics.describe('suggest_recipes_scanned_total', 'counter', "Candidate recipes scored by suggest.")
+        metrics.describe('suggest_substitute_lookups_total', 'counter',
+                         "Substitute lookups for missing required ingredients during scoring.")
+
+    def _record(self, timer, timing):
+        if timing is not None:
+            timing.update(timer.as_dict())
+        metrics = self.metrics
+        if metrics is None:
+            return
+        metrics.observe('suggest_seconds', timer.total())
+        for stage, seconds in timer.stages.items():
+            metrics.observe('suggest_stage_seconds', seconds, {'stage': stage})
+        metrics.inc('suggest_requests_total')
+        counts = timer.counts
+        if counts.get('cache_hit'):
+            metrics.inc('suggest_cache_hits_total')
+        else:
+            metrics.inc('suggest_recipes_scanned_total', counts.get('recipes_scanned', 0))
+            metrics.inc('suggest_substitute_lookups_total', counts.get('substitute_lookups', 0))
+
+    def suggest_batch(self, pantries, max_results=20, allow_subst=True, include_zero_overlap=False):
+        """Like suggest, for a list of pantries; returns one result list per pantry."""
+        return list(self.iter_suggest_batch(pantries, max_results, allow_subst, include_zero_overlap))
+
+    def iter_suggest_batch(self, pantries, max_results=20, allow_subst=True, include_zero_overlap=False):
+        """
+        Yields suggest results for each pantry, in order.
+        Rarity scores and substitution lookups are shared across the batch, identical pantries
+        are scored once, and the vector engine scores a whole chunk of pantries per matrix product.
+        """
+        snap = self.snapshot
+        pantries = [self._normalize(snap, p) for p in pantries]
+        done = {}
+        for start in range(0, len(pantries), self.BATCH_CHUNK):
+            if len(done) > self.BATCH_MEMO:
+                done.clear()
+            chunk = pantries[start:start + self.BATCH_CHUNK]
+            todo = list({frozenset(S): S for S in chunk if frozenset(S) not in done}.values())
+            if snap.vector is not None:
+                shortlists = snap.vector.shortlist_batch(todo, max_results, allow_subst, include_zero_overlap)
+            else:
+                shortlists = [self._candidates(snap, S, allow_subst, include_zero_overlap) for S in todo]
+            for S, r_ids in zip(todo, shortlists):
+                done[frozenset(S)] = self._rank(snap, S, r_ids, max_results, allow_subst)
+            for S in chunk:
+                yield done[frozenset(S)]
+
+    def _normalize(self, snap, user_ingredients):
+        # pantry names -> vocabulary ids; unknown names can't match any recipe or substitute
+        return snap.vocab.ids_of([u.strip().lower() for u in (user_ingredients or [])])
+
+    def _rank(self, snap, S, r_ids, max_results, allow_subst, timer=None):
+        counts = timer.counts if timer is not None else {}
+        counts['recipes_scanned'] = len(r_ids)
+        counts.setdefault('substitute_lookups', 0)
+        # substitution lookups are done once per pantry, not per missing ingredient of every candidate
+        substitutable = self._substitutable(snap, S) if allow_subst else None
+        if timer is not None:
+            timer.lap('substitute')
+        # score with lightweight tuples: (score, -matched, -required_count, -r_id)
+        scored = [self._score_recipe(snap, r_id, S, allow_subst, counts=counts, substitutable=substitutable)
+                  for r_id in r_ids]
+        if timer is not None:
+            timer.lap('score')
+
+        top = _top(scored, max_results)
+        if timer is not None:
+            timer.lap('select')
+
+        # missing lists and substitution plans are only built for the winners
+        out = self._details(snap, [-key[3] for key in top], S, allow_subst)
+        if timer is not None:
+            timer.lap('detail')
+        return out
+
+    def _details(self, snap, r_ids, S, allow_subst):
         out = []
-        for item in candidates[:max_results]:
-            r = self.recipes[item['r_id']]
+        for r_id in r_ids:
+            item = self._score_recipe(snap, r_id, S, allow_subst, detail=True)
+            r = snap.recipes[item['r_id']]
             out.append({
                 'recipe_id': item['r_id'],
                 'name': r['name'],
@@ -138,3 +649,408 @@ class RecipeMatcher:
                 'substitution_plan': item['substitution_plan']
             })
         return out
+
+    # --- incremental sessions ---
+
+    def session(self, user_ingredients=None, allow_subst=True, include_zero_overlap=False):
+        """A PantrySession: a pantry edited one ingredient at a time and rescored incrementally."""
+        return PantrySession(self, user_ingredients, allow_subst, include_zero_overlap)
+
+    # --- shopping plan ---
+
+    def shopping_plan(self, user_ingredients=None, max_items=5, allow_subst=True, max_results=20):
+        """
+        Up to max_items ingredients to buy that make the most recipes cookable (no required
+        ingredient missing after substitution), chosen greedily as a weighted max coverage:
+        each recipe sharing a required ingredient with the pantry and missing g of them
+        contributes g gaps of weight 1/g, and buying an ingredient fills every gap it is, or
+        is a scored substitute for (so one purchase can fill several gaps of a recipe).
+        A recipe counts fully once all its gaps are filled.
+        Gains only shrink as gaps fill, so a lazy priority queue re-evaluates just the popped
+        ingredient (over the few ingredients it fills) instead of every candidate per pick.
+        Gains are summed in ingredient id order and rounded, so equal gains compare equal
+        whatever order the engine produced the gaps in, and ties go to the lower ingredient id.
+        Returns {'purchases': [{'ingredient', 'recipes_unlocked', 'gain'}, ...], 'total_unlocked': n,
+                 'unlocked': suggest-style details of the first max_results recipes unlocked, best first}.
+        """
+        snap = self.snapshot
+        S = self._normalize(snap, user_ingredients)
+        scorer = self._gap_scorer(snap)
+        if scorer is not None:
+            weight, fills, unlocked_by = scorer.purchase_gaps(S, allow_subst)
+        else:
+            weight, fills, unlocked_by = self._purchase_gaps(snap, S, allow_subst)
+
+        fills = {x: sorted(ms) for x, ms in fills.items()}
+        filled = {}                       # missing ingredient -> pick that filled its gaps
+        def gain(x):
+            # float sums of 1/g weights differ in the last bit with the order they are added in
+            return round(sum(weight[m] for m in fills[x] if m not in filled), 9)
+
+        heap = [(-gain(x), x) for x in fills]
+        heapq.heapify(heap)
+        picks = []
+        while heap and len(picks) < max_items:
+            _, x = heapq.heappop(heap)
+            current = gain(x)
+            if current <= 0:
+                continue
+            if heap and (-current, x) > heap[0]:
+                # stale: another ingredient may now be better
+                heapq.heappush(heap, (-current, x))
+                continue
+            for m in fills[x]:
+                filled.setdefault(m, len(picks))
+            picks.append((x, current))
+
+        counts, first = unlocked_by(filled, len(picks), max_results)
+        bought = S | {x for x, _ in picks}
+        top = _top([self._score_recipe(snap, r_id, bought, allow_subst) for r_id in first], max_results)
+        return {
+            'purchases': [{'ingredient': snap.vocab.name_of(x), 'recipes_unlocked': n,
+                           'gain': round(g, 3)} for (x, g), n in zip(picks, counts)],
+            'total_unlocked': sum(counts),
+            'unlocked': self._details(snap, [-key[3] for key in top], bought, allow_subst),
+        }
+
+    def _gap_scorer(self, snap):
+        """
+        The VectorScorer shopping plans take their gaps from: the vector engine's, or on the python
+        engine one built for the snapshot on first use (a plan walks every recipe sharing an
+        ingredient with the pantry, too many for the per-recipe loop). None without numpy/scipy.
+        """
+        if snap.vector is not None:
+            return snap.vector
+        if snap.gap_scorer is None:
+            from vector_scoring import VectorScorer, np
+            if np is None:
+                return None
+            with self._gap_lock:
+                if snap.gap_scorer is None:
+                    snap.gap_scorer = VectorScorer(snap, self.SUBST_LIMIT)
+        return snap.gap_scorer
+
+    def _purchase_gaps(self, snap, S, allow_subst):
+        """
+        Shopping-plan inputs for pantry S, one recipe at a time: (weight, fills, unlocked_by) with
+        weight[m] the summed gap weight of missing ingredient m, fills[x] the missing ingredients
+        whose gaps buying x fills, and unlocked_by(filled, n, limit) -> (recipes completed by each
+        of n picks, the first limit of those recipe ids in pick then catalog order) given
+        {missing ingredient: pick}.
+        """
+        # ingredients the pantry already covers, directly or through a substitute
+        covered = set(S)
+        if allow_subst:
+            for ing in S:
+                covered.update(snap.substitutes_for.get(ing, _EMPTY))
+        hits = Counter()
+        for ing in covered:
+            hits.update(snap.req_postings.get(ing, _EMPTY))
+
+        gaps = {}                         # recipe id -> required ingredients still missing
+        weight = defaultdict(float)
+        for r_id, n in hits.items():
+            required = snap.req_ings.get(r_id, _EMPTY)
+            if len(required) == n:
+                continue
+            missing = gaps[r_id] = [m for m in required if m not in covered]
+            for m in missing:
+                weight[m] += 1.0 / len(missing)
+
+        fills = defaultdict(list)
+        for m in weight:
+            fills[m].append(m)
+            if allow_subst:
+                for sub, score, _ in snap.subst.find_substitute_ids(m, limit=self.SUBST_LIMIT):
+                    if score > 0 and sub != m:
+                        fills[sub].append(m)
+
+        def unlocked_by(filled, n, limit):
+            rounds = [[] for _ in range(n)]
+            for r_id in sorted(gaps):
+                missing = gaps[r_id]
+                if all(m in filled for m in missing):
+                    rounds[max(filled[m] for m in missing)].append(r_id)
+            return [len(r_ids) for r_ids in rounds], [r_id for r_ids in rounds for r_id in r_ids][:max(limit, 0)]
+
+        return weight, fills, unlocked_by
+
+    # --- pagination ---
+
+    def suggest_page(self, user_ingredients=None, page_size=20, cursor=None, allow_subst=True,
+                     include_zero_overlap=False):
+        """
+        One page of the complete ranking suggest would produce:
+        {'results': [...], 'total': candidates ranked, 'next_cursor': str or None}.
+        Pass next_cursor back (the pantry and flags are taken from it) for the following page.
+        The ranking is computed once per pantry and kept in the ranking cache, so later pages
+        only build the details of their own recipes. Cursors are self-contained, so a page
+        can be served by any process; one whose ranking was evicted just ranks again.
+        """
+        if page_size < 1:
+            raise ValueError("page_size must be at least 1")
+        offset = 0
+        if cursor:
+            user_ingredients, allow_subst, include_zero_overlap, offset = decode_cursor(cursor)
+        snap = self.snapshot
+        S = self._normalize(snap, user_ingredients)
+        ranked = self._ranking(snap, S, allow_subst, include_zero_overlap)
+        end = offset + page_size
+        next_cursor = None
+        if end < len(ranked):
+            pantry = sorted(snap.vocab.name_of(i) for i in S)
+            next_cursor = encode_cursor(pantry, allow_subst, include_zero_overlap, end)
+        return {
+            'results': self._details(snap, ranked[offset:end], S, allow_subst),
+            'total': len(ranked),
+            'next_cursor': next_cursor,
+        }
+
+    def _ranking(self, snap, S, allow_subst, include_zero_overlap):
+        """Candidate recipe ids of pantry S, best first, as an array('i')."""
+        key = (tuple(sorted(S)), allow_subst, include_zero_overlap)
+        if self.rankings is not None:
+            ranked = self.rankings.get(key, snap.stats.version)
+            if ranked is not None:
+                return ranked
+        # every candidate is scored exactly (the vector engine only shortlists a top-k)
+        r_ids = self._candidates(snap, S, allow_subst, include_zero_overlap)
+        scored = [self._score_recipe(snap, r_id, S, allow_subst) for r_id in r_ids]
+        scored.sort(reverse=True)
+        ranked = array('i', [-key[3] for key in scored])
+        if self.rankings is not None:
+            self.rankings.put(key, ranked, snap.stats.version, size=ranked.itemsize * len(ranked) + 64)
+        return ranked
+
+    @staticmethod
+    def _substitutable(snap, S):
+        """Required ingredients that some ingredient of pantry S is a usable (score > 0) substitute for."""
+        out = set()
+        for ing in S:
+            out.update(snap.substitutes_for.get(ing, _EMPTY))
+        return out
+
+    def _score_recipe(self, snap, r_id, S, allow_subst, detail=False, counts=None, substitutable=None):
+        """
+        Ranking tuple (score, -matched, -required_count, -r_id) for recipe r_id against
+        pantry ids S, or with detail the full candidate dict (ingredient names restored).
+        counts: optional dict whose 'substitute_lookups' is incremented per lookup made
+        substitutable: _substitutable(snap, S), to answer the ranking tuple without per-ingredient lookups
+        """
+        required = snap.req_ings.get(r_id, _EMPTY)
+        optional = snap.opt_ings.get(r_id, _EMPTY)
+        missing = [i for i in required if i not in S]
+        optional_missing = sum(1 for i in optional if i not in S)
+
+        subst_plan = {}
+        covered = set()
+
+        if allow_subst and missing:
+            if counts is not None:
+                counts['substitute_lookups'] += len(missing)
+            # a missing ingredient is covered when the pantry holds any usable substitute for it;
+            # which one (the best) only matters for the detail's substitution plan
+            if substitutable is not None and not detail:
+                covered = [m for m in missing if m in substitutable]
+                missing_todo = _EMPTY
+            else:
+                missing_todo = missing
+            # try to cover each missing ingredient with substitutes
+            for m in missing_todo:
+                subs = snap.subst.find_substitute_ids(m, limit=self.SUBST_LIMIT)
+                # prefer substitutes present in S
+                chosen = None
+                chosen_score = 0.0
+                chosen_reason = None
+                for sub, score, reason in subs:
+                    if sub in S:
+                        # choose best substitute present in pantry
+                        if score > chosen_score:
+                            chosen = sub
+                            chosen_score = score
+                            chosen_reason = reason
+                if chosen is not None:
+                    covered.add(m)
+                    if detail:
+                        name_of = snap.vocab.name_of
+                        plan = subst_plan[name_of(m)] = {'substitute': name_of(chosen), 'score': chosen_score,
+                                                         'reason': chosen_reason}
+                        if chosen_reason == 'chain':
+                            # e.g. ['ghee', 'butter', 'margarine']
+                            plan['chain'] = snap.subst.find_chain(name_of(m), name_of(chosen))
+        covered_by_subst = len(covered)
+
+        req_count = max(1, len(required))
+        # match fraction after substitution
+        matched = req_count - (len(missing) - covered_by_subst)
+        match_fraction = matched / req_count
+
+        # substitution coverage fraction
+        subst_fraction = covered_by_subst / req_count
+
+        # optional penalty
+        optional_penalty = optional_missing / max(1, len(optional) + 1)
+
+        # rarity bonus: if user has rare ingredients required by recipe, bump score a bit
+        rarity_bonus = 0.0
+        for ing in required:
+            if ing in S:
+                rarity_bonus += 0.05 * snap.stats.rarity_of(ing)  # small additive bonus
+
+        # final score (weighted)
+        score = (0.7 * match_fraction) + (0.18 * subst_fraction) + (0.02 * rarity_bonus) - (0.04 * optional_penalty)
+
+        # normalize score into 0..1
+        score = max(0.0, min(1.0, score))
+
+        if not detail:
+            return (score, -matched, -req_count, -r_id)
+
+        # additional metadata for ranking: fewer total required ingredients preferred if scores close
+        return {
+            'score': score,
+            'r_id': r_id,
+            'missing_after_subst': sorted(snap.vocab.name_of(m) for m in missing if m not in covered),
+            'substitution_plan': subst_plan,
+            'required_count': req_count,
+            'matched_count': matched
+        }
+
+class PantrySession:
+    """
+    A pantry that is edited one ingredient at a time (chip editing), with results kept current
+    incrementally. The session holds the ranking key of every candidate recipe and, per recipe,
+    how many pantry ingredients reach it directly or as a substitute for one of its required
+    ingredients. Adding or removing an ingredient rescores only the recipes that ingredient
+    reaches (its postings plus those of the ingredients it substitutes for), so an edit costs
+    O(postings of one ingredient) rather than O(catalog). results() matches suggest exactly.
+    A catalog reload is picked up on the next call by rebuilding from the pantry names.
+    Not thread-safe: callers sharing a session serialise on its lock.
+    """
+
+    def __init__(self, matcher, user_ingredients=None, allow_subst=True, include_zero_overlap=False):
+        self.matcher = matcher
+        self.allow_subst = allow_subst
+        self.include_zero_overlap = include_zero_overlap
+        self.lock = threading.Lock()
+        self.names = set()   # normalized pantry names, unknown ones included (a reload may add them)
+        self._reset(_normalize_names(user_ingredients))
+
+    def _reset(self, names):
+        snap = self.snap = self.matcher.snapshot
+        self.names = set(names)
+        self.S = snap.vocab.ids_of(self.names)
+        self._always = set(snap.always_candidates)
+        self.reach = defaultdict(int)   # recipe id -> pantry ingredients reaching it
+        for ing in self.S:
+            for r_id in self._reached(ing):
+                self.reach[r_id] += 1
+        r_ids = self.matcher._candidates(snap, self.S, self.allow_subst, self.include_zero_overlap)
+        self.scores = {r_id: self.matcher._score_recipe(snap, r_id, self.S, self.allow_subst) for r_id in r_ids}
+
+    def _reached(self, ing):
+        # recipes whose score can change when ing enters or leaves the pantry (may repeat ids)
+        snap = self.snap
+        yield from snap.postings.get(ing, _EMPTY)
+        if self.allow_subst:
+            for orig in snap.substitutes_for.get(ing, _EMPTY):
+                yield from snap.req_postings.get(orig, _EMPTY)
+
+    @property
+    def pantry(self):
+        return sorted(self.names)
+
+    def size_bytes(self):
+        """Rough memory held by the session, for charging it against a ResultCache byte budget."""
+        # per tracemalloc: ~200 B per scored recipe (dict slot, key tuple and its numbers), ~80 B per reach count
+        return 200 * len(self.scores) + 80 * len(self.reach) + 64 * len(self.names) + 1024
+
+    def set_pantry(self, user_ingredients):
+        """Bring the session to this full pantry by applying the difference as a delta."""
+        names = set(_normalize_names(user_ingredients))
+        self.update(add=names - self.names, remove=self.names - names)
+
+    def update(self, add=(), remove=()):
+        """Add and remove pantry ingredients, rescoring only the recipes they reach."""
+        add = set(_normalize_names(add)) - self.names
+        remove = set(_normalize_names(remove)) & self.names
+        if self.snap is not self.matcher.snapshot:
+            self._reset((self.names | add) - remove)
+            return
+        vocab = self.snap.vocab
+        touched = set()
+        for names, step in ((remove, -1), (add, 1)):
+            for name in names:
+                ing = vocab.id_of(name)
+                if step > 0:
+                    self.names.add(name)
+                else:
+                    self.names.discard(name)
+                if ing is None:
+                    continue
+                if step > 0:
+                    self.S.add(ing)
+                else:
+                    self.S.discard(ing)
+                for r_id in self._reached(ing):
+                    n = self.reach[r_id] + step
+                    if n:
+                        self.reach[r_id] = n
+                    else:
+                        del self.reach[r_id]
+                    touched.add(r_id)
+        for r_id in touched:
+            if r_id in self.reach or self.include_zero_overlap or r_id in self._always:
+                self.scores[r_id] = self.matcher._score_recipe(self.snap, r_id, self.S, self.allow_subst)
+            else:
+                self.scores.pop(r_id, None)
+
+    def results(self, max_results=20):
+        """What suggest would return for the current pantry."""
+        if self.snap is not self.matcher.snapshot:
+            self._reset(self.names)
+        top = _top(list(self.scores.values()), max_results)
+        return self.matcher._details(self.snap, [-key[3] for key in top], self.S, self.allow_subst)
+
+
+def _normalize_names(names):
+    return [n.strip().lower() for n in (names or [])]
+
+def _top(scored, max_results):
+    # sort by score desc, tiebreaker: fewer missing after subst, more matched, fewer required_count;
+    # -r_id keeps remaining ties in catalog order, as the old stable sort did
+    if 0 <= max_results < len(scored):
+        return heapq.nlargest(max_results, scored)
+    return sorted(scored, reverse=True)[:max_results]
+
+def encode_cursor(pantry, allow_subst, include_zero_overlap, offset):
+    state = {'p': pantry, 's': bool(allow_subst), 'z': bool(include_zero_overlap), 'o': offset}
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """(pantry names, allow_subst, include_zero_overlap, offset); ValueError if cursor is malformed."""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        pantry, offset = state['p'], state['o']
+        if not (isinstance(pantry, list) and all(isinstance(p, str) for p in pantry)
+                and isinstance(offset, int) and offset >= 0):
+            raise ValueError
+        return pantry, bool(state['s']), bool(state['z']), offset
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise ValueError("invalid cursor") from None
+
+def _file_signature(paths):
+    sig = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            sig.append((st.st_size, st.st_mtime_ns))
+        except FileNotFoundError:
+            sig.append(None)
+    return tuple(sig)
+
+def _chunks(items, size=500):
+    # keep IN (...) lists under SQLite's bound-parameter limit
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
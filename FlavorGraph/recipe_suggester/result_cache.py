@@ -0,0 +1,101 @@
+# result_cache.py
+import json
+import threading
+import time
+from collections import OrderedDict
+
+class ResultCache:
+    """
+    Thread-safe LRU cache with per-entry TTL for suggestion results.
+    Memory is bounded by max_entries and/or max_bytes (size estimated from the JSON
+    encoding of each value). Entries are tagged with the catalog version they were
+    computed against; seeing a newer version drops everything.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=None, ttl=300.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()  # key -> (expires_at, size, value)
+        self._lock = threading.Lock()
+        self._version = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_version(self, version):
+        if version != self._version:
+            if self._data:
+                self.invalidations += 1
+            self._data.clear()
+            self.bytes = 0
+            self._version = version
+
+    def get(self, key, version=None):
+        """Cached value for key, or None on a miss."""
+        with self._lock:
+            self._check_version(version)
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at is not None and expires_at <= self._clock():
+                del self._data[key]
+                self.bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, version=None, size=None):
+        """size: bytes to charge for value, for values that aren't JSON (e.g. arrays)"""
+        if size is None:
+            size = len(json.dumps(value)) if self.max_bytes else 0
+        if self.max_entries == 0 or (self.max_bytes and size > self.max_bytes):
+            return
+        expires_at = self._clock() + self.ttl if self.ttl else None
+        with self._lock:
+            self._check_version(version)
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (expires_at, size, value)
+            self.bytes += size
+            # evict least recently used entries until within budget
+            while self._data and ((self.max_entries and len(self._data) > self.max_entries)
+                                  or (self.max_bytes and self.bytes > self.max_bytes)):
+                _, (_, old_size, _) = self._data.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'bytes': self.bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
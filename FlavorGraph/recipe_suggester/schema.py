@@ -0,0 +1,150 @@
+# schema.py
+"""Schema pieces shared by the seeding / ingestion scripts and the matcher."""
+import re
+import sqlite3
+import uuid
+
+CATALOG_SQL = """
+CREATE TABLE IF NOT EXISTS ingredients (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  name TEXT UNIQUE NOT NULL,
+  category TEXT,
+  unit TEXT
+);
+CREATE TABLE IF NOT EXISTS recipes (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  name TEXT NOT NULL,
+  cuisine TEXT,
+  servings INTEGER DEFAULT 1,
+  instructions TEXT
+);
+CREATE TABLE IF NOT EXISTS recipe_ingredients (
+  recipe_id INTEGER,
+  ingredient_id INTEGER,
+  qty REAL,
+  unit TEXT,
+  optional INTEGER DEFAULT 0,
+  PRIMARY KEY (recipe_id, ingredient_id),
+  FOREIGN KEY (recipe_id) REFERENCES recipes(id),
+  FOREIGN KEY (ingredient_id) REFERENCES ingredients(id)
+);
+CREATE TABLE IF NOT EXISTS substitutions (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  ingredient_id INTEGER NOT NULL,
+  substitute_id INTEGER NOT NULL,
+  score REAL DEFAULT 0.5,
+  notes TEXT,
+  FOREIGN KEY (ingredient_id) REFERENCES ingredients(id),
+  FOREIGN KEY (substitute_id) REFERENCES ingredients(id)
+);
+CREATE TABLE IF NOT EXISTS catalog_meta (
+  key TEXT PRIMARY KEY,
+  value TEXT
+);
+"""
+
+_DROP_SQL = """
+DROP TABLE IF EXISTS ingredient_search;
+DROP TABLE IF EXISTS catalog_changes;
+DROP TABLE IF EXISTS substitutions;
+DROP TABLE IF EXISTS recipe_ingredients;
+DROP TABLE IF EXISTS recipes;
+DROP TABLE IF EXISTS ingredients;
+"""
+
+def create_catalog(conn, drop=False):
+    """
+    Create the recipe catalog tables; drop=True starts from an empty catalog.
+    A new catalog (created or dropped) gets a fresh generation id, see catalog_generation.
+    """
+    conn.executescript("PRAGMA foreign_keys = ON;\n" + (_DROP_SQL if drop else '') + CATALOG_SQL)
+    conn.execute(f"INSERT OR {'REPLACE' if drop else 'IGNORE'} INTO catalog_meta (key, value) VALUES ('generation', ?)",
+                 (uuid.uuid4().hex,))
+
+def catalog_generation(conn):
+    """
+    Random id given to the catalog when it was created or last emptied, or None for a DB that
+    predates it. Unlike change ids it can't repeat when a DB is deleted and seeded again.
+    """
+    try:
+        row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'generation'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+# Secondary indexes for lookups that don't go through a primary key: substitutes of an
+# ingredient and recipes using an ingredient (incremental reload). Built after bulk loads,
+# not before, so inserts don't maintain them row by row.
+READ_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_substitutions_ingredient ON substitutions(ingredient_id, score DESC);
+CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_ingredient ON recipe_ingredients(ingredient_id);
+"""
+
+# Name lookups are answered from SubstitutionEngine's in-memory maps, so catalogs built with
+# the former norm_name index and FTS5 ingredient_search table (and its triggers) lose them.
+_UNUSED_SQL = """
+DROP TRIGGER IF EXISTS ingredients_insert_search;
+DROP TRIGGER IF EXISTS ingredients_delete_search;
+DROP TRIGGER IF EXISTS ingredients_update_search;
+DROP TABLE IF EXISTS ingredient_search;
+DROP INDEX IF EXISTS idx_ingredients_norm_name;
+"""
+
+def install_read_indexes(conn):
+    """Create the secondary indexes (idempotent) and drop the unused ones older catalogs carry."""
+    conn.executescript(_UNUSED_SQL + READ_INDEX_SQL)
+    conn.execute('ANALYZE')
+
+def drop_read_indexes(conn):
+    """Drop the READ_INDEX_SQL indexes before a bulk load into an empty catalog; install_read_indexes rebuilds them."""
+    for name in re.findall(r'CREATE INDEX IF NOT EXISTS (\w+)', READ_INDEX_SQL):
+        conn.execute(f'DROP INDEX IF EXISTS {name}')
+
+def enable_wal(conn):
+    """Switch the database to WAL so readers never block on (or block) a writer; persists in the file."""
+    return conn.execute('PRAGMA journal_mode = WAL').fetchone()[0] == 'wal'
+
+# Change log read by RecipeMatcher.reload(): triggers record which recipe, ingredient or
+# substitution rows changed so a running server can re-read only those.
+CHANGE_LOG_SQL = """
+CREATE TABLE IF NOT EXISTS catalog_changes (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  entity TEXT NOT NULL,           -- 'recipe', 'ingredient', 'substitution' or 'catalog' (reload everything)
+  entity_id INTEGER NOT NULL,     -- recipes.id, ingredients.id, substitutions.ingredient_id or 0
+  changed_at REAL DEFAULT (julianday('now'))
+);
+"""
+
+# (table, entity logged, column holding the entity id)
+_TRACKED = [
+    ('recipes', 'recipe', 'id'),
+    ('recipe_ingredients', 'recipe', 'recipe_id'),
+    ('ingredients', 'ingredient', 'id'),
+    ('substitutions', 'substitution', 'ingredient_id'),
+]
+
+def change_log_triggers():
+    sql = []
+    for table, entity, col in _TRACKED:
+        for event, rows in (('INSERT', ['NEW']), ('UPDATE', ['OLD', 'NEW']), ('DELETE', ['OLD'])):
+            body = ''.join(f"INSERT INTO catalog_changes (entity, entity_id) VALUES ('{entity}', {r}.{col}); "
+                           for r in rows)
+            sql.append(f"CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_log AFTER {event} ON {table} "
+                       f"BEGIN {body}END;")
+    return '\n'.join(sql)
+
+def install_change_log(conn):
+    """Create the catalog_changes table and its triggers (idempotent)."""
+    conn.executescript(CHANGE_LOG_SQL + change_log_triggers())
+
+def has_change_log(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'catalog_changes'").fetchone() is not None
+
+def drop_change_log_triggers(conn):
+    """
+    Stop logging row by row (bulk loads log what they inserted in one statement instead);
+    install_change_log puts the triggers back.
+    """
+    for table, _, _ in _TRACKED:
+        for event in ('insert', 'update', 'delete'):
+            conn.execute(f'DROP TRIGGER IF EXISTS {table}_{event}_log')
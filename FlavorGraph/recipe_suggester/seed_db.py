@@ -1,6 +1,8 @@
 # seed_db.py
 import os
 import sqlite3
+from schema import create_catalog, enable_wal, has_change_log, install_change_log, install_read_indexes
+from ingest import CatalogLoader
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
@@ -11,46 +13,9 @@ print("Seeding DB at:", DB_PATH)
 conn = sqlite3.connect(DB_PATH)
 cur = conn.cursor()
 
-cur.executescript("""
-PRAGMA foreign_keys = ON;
-DROP TABLE IF EXISTS substitutions;
-DROP TABLE IF EXISTS recipe_ingredients;
-DROP TABLE IF EXISTS recipes;
-DROP TABLE IF EXISTS ingredients;
-
-CREATE TABLE IF NOT EXISTS ingredients (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  name TEXT UNIQUE NOT NULL,
-  category TEXT,
-  unit TEXT
-);
-CREATE TABLE IF NOT EXISTS recipes (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  name TEXT NOT NULL,
-  cuisine TEXT,
-  servings INTEGER DEFAULT 1,
-  instructions TEXT
-);
-CREATE TABLE IF NOT EXISTS recipe_ingredients (
-  recipe_id INTEGER,
-  ingredient_id INTEGER,
-  qty REAL,
-  unit TEXT,
-  optional INTEGER DEFAULT 0,
-  PRIMARY KEY (recipe_id, ingredient_id),
-  FOREIGN KEY (recipe_id) REFERENCES recipes(id),
-  FOREIGN KEY (ingredient_id) REFERENCES ingredients(id)
-);
-CREATE TABLE IF NOT EXISTS substitutions (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  ingredient_id INTEGER NOT NULL,
-  substitute_id INTEGER NOT NULL,
-  score REAL DEFAULT 0.5,
-  notes TEXT,
-  FOREIGN KEY (ingredient_id) REFERENCES ingredients(id),
-  FOREIGN KEY (substitute_id) REFERENCES ingredients(id)
-);
-""")
+# change ids must keep rising across a re-seed, or a running server would think nothing changed
+last_change = cur.execute('SELECT COALESCE(MAX(id), 0) FROM catalog_changes').fetchone()[0] if has_change_log(conn) else 0
+create_catalog(conn, drop=True)
 
 # Insert ingredients (expandable)
 ingredients = [
@@ -139,24 +104,13 @@ recipes = [
     ('Tomato Pasta', 'Italian', 2, 'Cook pasta, prepare tomato garlic sauce.'),
 ]
 
-cur.executemany("INSERT INTO recipes (name, cuisine, servings, instructions) VALUES (?, ?, ?, ?);", recipes)
-
-# Map names -> ids
-cur.execute("SELECT id, name FROM ingredients;")
-rows = cur.fetchall()
-name_to_id = {name: iid for iid, name in rows}
-
-cur.execute("SELECT id, name FROM recipes;")
-rows = cur.fetchall()
-recipe_to_id = {name: rid for rid, name in rows}
+records = {name: {'name': name, 'cuisine': cuisine, 'servings': servings, 'instructions': instructions,
+                  'ingredients': []}
+           for name, cuisine, servings, instructions in recipes}
 
 # Helper to add recipe ingredient by name
 def add_ing(recipe_name, ing_name, qty=0, unit='', optional=0):
-    rid = recipe_to_id.get(recipe_name)
-    iid = name_to_id.get(ing_name)
-    if rid and iid:
-        cur.execute("INSERT OR IGNORE INTO recipe_ingredients (recipe_id, ingredient_id, qty, unit, optional) VALUES (?, ?, ?, ?, ?)",
-                    (rid, iid, qty, unit, optional))
+    records[recipe_name]['ingredients'].append({'name': ing_name, 'qty': qty, 'unit': unit, 'optional': optional})
 
 # Add ingredients to recipes (simplified essential sets)
 # Pesarattu
@@ -242,7 +196,13 @@ add_ing('Tomato Pasta', 'garlic', 2, 'cloves', 0)
 add_ing('Tomato Pasta', 'olive oil', 20, 'ml', 0)
 add_ing('Tomato Pasta', 'basil', 5, 'g', 1)
 
-conn.commit()
+# ingredients missing from the list above (eno, pasta, sambar masala, ...) are created by the loader
+CatalogLoader(conn).add_all(records.values())
+
+# Map names -> ids
+cur.execute("SELECT id, name FROM ingredients;")
+rows = cur.fetchall()
+name_to_id = {name: iid for iid, name in rows}
 
 # Add some substitution pairs (ingredient -> substitute, score 0..1)
 # butter -> margarine
@@ -262,5 +222,14 @@ add_sub('moong dal', 'toor dal', 0.5, 'Legumes can substitute but cooking times
 add_sub('ghee', 'butter', 0.9, 'Butter can often replace ghee.')
 
 conn.commit()
+
+# secondary indexes, built once the rows are in
+install_read_indexes(conn)
+# change log for hot reload; installed after seeding so the seed rows aren't logged one by one,
+# just as a single 'catalog' entry (servers rebuild from scratch), like ingest --replace
+install_change_log(conn)
+cur.execute("INSERT INTO catalog_changes (id, entity, entity_id) VALUES (?, 'catalog', 0)", (last_change + 1,))
+conn.commit()
+enable_wal(conn)
 conn.close()
 print("Seeding complete.")
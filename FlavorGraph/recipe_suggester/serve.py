@@ -0,0 +1,131 @@
+# serve.py
+"""
+Production launcher: N worker processes behind one port, sharing one mapped catalog.
+
+    python serve.py --workers 4 --port 5000
+
+The master loads recipes.db once, writes the catalog indexes to a binary snapshot file
+(snapshot_file.py), binds the listening socket and forks the workers. Each worker imports
+app.py with CATALOG_SNAPSHOT set, so its RecipeMatcher maps the snapshot read-only instead
+of building its own copy of the graph. The master keeps watching recipes.db, rewrites the
+snapshot when the catalog changes (workers re-map it on their next reload check) and
+restarts workers that exit.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('serve')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, 'data', 'recipes.db')
+SNAPSHOT_PATH = os.path.join(BASE_DIR, 'data', 'catalog.snap')
+INDEX_PATH = os.path.join(BASE_DIR, 'data', 'recipes.index')
+
+
+def build_snapshot(matcher, path):
+    t0 = time.perf_counter()
+    matcher.save_snapshot(path)
+    logger.info("Wrote catalog snapshot %s (%d recipes, %.1f MB) in %.2fs", path, len(matcher.recipes),
+                os.path.getsize(path) / 2 ** 20, time.perf_counter() - t0)
+
+
+def run_worker(sock, args):
+    # runs in the forked child: the app module (and its matcher) is created here, after the fork
+    os.environ['CATALOG_SNAPSHOT'] = args.snapshot
+    from werkzeug.serving import make_server
+    import app as app_module
+    server = make_server(args.host, args.port, app_module.app, threaded=True, fd=sock.fileno())
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    logger.info("Worker %d serving", os.getpid())
+    server.serve_forever()
+
+
+def spawn(sock, args):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(sock, args)
+        except KeyboardInterrupt:
+            pass
+        except Exception:
+            logger.exception("Worker %d crashed", os.getpid())
+            code = 1
+        os._exit(code)
+    return pid
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Serve the recipe API from a pool of forked workers.")
+    p.add_argument('--host', default='0.0.0.0')
+    p.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    p.add_argument('--workers', type=int, default=int(os.environ.get('WEB_WORKERS', os.cpu_count() or 2)))
+    p.add_argument('--db', default=DB_PATH)
+    p.add_argument('--snapshot', default=os.environ.get('CATALOG_SNAPSHOT', SNAPSHOT_PATH),
+                   help="where to write the shared catalog snapshot")
+    p.add_argument('--index', default=os.environ.get('CATALOG_INDEX', INDEX_PATH),
+                   help="index cache the master starts from when current (empty disables)")
+    p.add_argument('--reload-interval', type=float, default=float(os.environ.get('CATALOG_RELOAD_INTERVAL', 5)),
+                   help="seconds between checks of the DB for catalog changes (0 disables)")
+    args = p.parse_args(argv)
+
+    if not hasattr(os, 'fork'):
+        sys.exit("serve.py needs os.fork(); on this platform run app.py directly")
+
+    # the master never scores requests, so it always uses the plain python engine
+    from recipe_matching import RecipeMatcher
+    matcher = RecipeMatcher(args.db, index_path=args.index or None)
+    build_snapshot(matcher, args.snapshot)
+
+    sock = socket.create_server((args.host, args.port), backlog=128)
+    sock.set_inheritable(True)
+    logger.info("Listening on %s:%s with %d workers", args.host, args.port, args.workers)
+
+    workers = set(spawn(sock, args) for _ in range(args.workers))
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    next_check = time.monotonic() + args.reload_interval
+    while not stopping:
+        time.sleep(0.5)
+        # restart workers that died
+        for pid in list(workers):
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                workers.discard(pid)
+                if not stopping:
+                    logger.warning("Worker %d exited with status %s; restarting", pid, status)
+                    workers.add(spawn(sock, args))
+        if args.reload_interval > 0 and time.monotonic() >= next_check:
+            next_check = time.monotonic() + args.reload_interval
+            try:
+                if matcher.reload_if_changed():
+                    build_snapshot(matcher, args.snapshot)
+            except Exception as e:
+                logger.exception("Catalog reload failed: %s", e)
+
+    logger.info("Stopping %d workers", len(workers))
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in workers:
+        os.waitpid(pid, 0)
+    sock.close()
+
+
+if __name__ == '__main__':
+    main()
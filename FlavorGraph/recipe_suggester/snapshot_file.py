@@ -0,0 +1,366 @@
+# snapshot_file.py
+"""
+Compact binary catalog snapshot that worker processes map read-only.
+
+The indexes of a CatalogSnapshot are written once as flat arrays (CSR offsets + ids for
+recipe -> ingredients, ingredient -> recipes and the substitution edges) and every worker
+mmaps the same file, so the pages are shared through the OS page cache instead of each
+process holding its own copy of the graph.
+
+Layout: MAGIC, u32 header length, JSON header, then 8-byte aligned native-endian arrays
+listed in header['sections'] as name -> [offset from data start, typecode, count].
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left
+
+from catalog_stats import CatalogStats
+from vocab import IngredientVocab
+
+MAGIC = b'FGSNAP\x00\x01'
+FORMAT_VERSION = 2
+# reason codes of stored substitution edges
+REASONS = ('direct', 'category', 'fuzzy', 'chain')
+
+_EMPTY = ()
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def _csr(rows):
+    """Rows of ints -> (offsets 'q', concatenated values 'i')."""
+    ptr, idx = array('q', [0]), array('i')
+    for row in rows:
+        idx.extend(row)
+        ptr.append(len(idx))
+    return ptr, idx
+
+
+def _strings(values):
+    """Strings -> (offsets 'q', utf-8 blob 'B')."""
+    ptr, blob = array('q', [0]), bytearray()
+    for v in values:
+        blob += v.encode('utf-8')
+        ptr.append(len(blob))
+    return ptr, array('B', blob)
+
+
+def write_snapshot(snap, path, subst_limit, meta=None):
+    """
+    Write snap (a CatalogSnapshot) to path. The file is written next to path and renamed
+    into place, so processes mapping the old file keep a consistent view.
+    meta: extra JSON-serialisable header fields.
+    """
+    vocab = snap.vocab
+    n_ing = len(vocab)
+    recipe_ids = list(snap.recipes)
+    sections = {'recipe_ids': array('i', recipe_ids)}
+
+    sections['req_ptr'], sections['req_idx'] = _csr(snap.req_ings.get(r, _EMPTY) for r in recipe_ids)
+    sections['opt_ptr'], sections['opt_idx'] = _csr(snap.opt_ings.get(r, _EMPTY) for r in recipe_ids)
+    for name, index in (('post', snap.postings), ('req_post', snap.req_postings),
+                        ('subfor', snap.substitutes_for)):
+        sections[name + '_ptr'], sections[name + '_idx'] = _csr(sorted(index.get(i, _EMPTY)) for i in range(n_ing))
+    sections['popularity'] = array('i', (snap.ingredient_popularity.get(i, 0) for i in range(n_ing)))
+    sections['always'] = array('i', snap.always_candidates)
+
+    # substitution edges, precomputed for every recipe ingredient at the matcher's limit;
+    # chain edges also keep their path (per edge, empty for the others)
+    sub_ptr, sub_ids, sub_scores, sub_reasons = array('q', [0]), array('i'), array('d'), array('b')
+    chain_ptr, chain_idx = array('q', [0]), array('i')
+    for i in range(n_ing):
+        if i in snap.req_postings:
+            for sub, score, reason in snap.subst.find_substitute_ids(i, limit=subst_limit):
+                sub_ids.append(sub)
+                sub_scores.append(score)
+                sub_reasons.append(REASONS.index(reason))
+                if reason == 'chain':
+                    chain_idx.extend(vocab.intern(n) for n in snap.subst.find_chain(vocab.name_of(i),
+                                                                                  vocab.name_of(sub)))
+                chain_ptr.append(len(chain_idx))
+        sub_ptr.append(len(sub_ids))
+    sections.update(sub_ptr=sub_ptr, sub_ids=sub_ids, sub_scores=sub_scores, sub_reasons=sub_reasons,
+                    chain_ptr=chain_ptr, chain_idx=chain_idx)
+
+    sections['names_ptr'], sections['names'] = _strings(vocab.names[:n_ing])
+    # recipe rows are only decoded for returned results, so keep them as small JSON records
+    sections['meta_ptr'], sections['meta'] = _strings(
+        json.dumps([r['name'], r.get('cuisine'), r.get('servings')]) for r in snap.recipes.values())
+
+    header = dict(meta or {})
+    header.update({
+        'format': FORMAT_VERSION,
+        'byteorder': sys.byteorder,
+        'subst_limit': subst_limit,
+        'built_at': snap.stats.built_at,
+        'required_links': snap.stats.required_links,
+        'optional_links': snap.stats.optional_links,
+        'sections': {},
+    })
+    offset = 0
+    for name, arr in sections.items():
+        header['sections'][name] = [offset, arr.typecode, len(arr)]
+        offset = _align(offset + len(arr) * arr.itemsize)
+    head = json.dumps(header).encode('utf-8')
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(head)))
+            f.write(head)
+            f.write(b'\0' * (_align(f.tell()) - f.tell()))
+            for arr in sections.values():
+                arr.tofile(f)
+                f.write(b'\0' * (_align(f.tell()) - f.tell()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return header
+
+
+def read_header(path):
+    """The JSON header of a snapshot file (raises ValueError if it isn't one)."""
+    with open(path, 'rb') as f:
+        head = f.read(len(MAGIC) + 4)
+        if len(head) < len(MAGIC) + 4 or head[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a catalog snapshot")
+        (size,) = struct.unpack('<I', head[len(MAGIC):])
+        return json.loads(f.read(size))
+
+
+def _row_finder(recipe_ids):
+    """recipe id -> row number (or None); plain arithmetic when the ids have no gaps."""
+    n = len(recipe_ids)
+    if n and recipe_ids[n - 1] - recipe_ids[0] == n - 1:
+        first = recipe_ids[0]
+
+        def row_of(r_id):
+            row = r_id - first
+            return row if 0 <= row < n else None
+    else:
+        def row_of(r_id):
+            row = bisect_left(recipe_ids, r_id)
+            return row if row < n and recipe_ids[row] == r_id else None
+    return row_of
+
+
+class _RowIndex:
+    """recipe id -> ingredient ids, as memoryview slices of the mapped CSR arrays."""
+
+    def __init__(self, recipe_ids, ptr, idx):
+        self.recipe_ids = recipe_ids
+        self.ptr = ptr
+        self.idx = idx
+        self._row = _row_finder(recipe_ids)
+
+    def get(self, r_id, default=None):
+        row = self._row(r_id)
+        if row is None:
+            return default
+        lo, hi = self.ptr[row], self.ptr[row + 1]
+        return self.idx[lo:hi] if hi > lo else default
+
+    def __getitem__(self, r_id):
+        out = self.get(r_id)
+        if out is None:
+            raise KeyError(r_id)
+        return out
+
+    def __contains__(self, r_id):
+        return self.get(r_id) is not None
+
+    def items(self):
+        ptr, idx = self.ptr, self.idx
+        for row, r_id in enumerate(self.recipe_ids):
+            if ptr[row + 1] > ptr[row]:
+                yield r_id, idx[ptr[row]:ptr[row + 1]]
+
+    def values(self):
+        return (v for _, v in self.items())
+
+    def __iter__(self):
+        return (r_id for r_id, _ in self.items())
+
+
+class _DenseIndex:
+    """ingredient id -> sorted ids, over CSR arrays with one row per vocabulary id."""
+
+    def __init__(self, ptr, idx):
+        self.ptr = ptr
+        self.idx = idx
+        self.n = len(ptr) - 1
+        self._len = sum(1 for i in range(self.n) if ptr[i + 1] > ptr[i])
+
+    def get(self, i, default=None):
+        if 0 <= i < self.n:
+            lo, hi = self.ptr[i], self.ptr[i + 1]
+            if hi > lo:
+                return self.idx[lo:hi]
+        return default
+
+    def __getitem__(self, i):
+        out = self.get(i)
+        if out is None:
+            raise KeyError(i)
+        return out
+
+    def __contains__(self, i):
+        return self.get(i) is not None
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        ptr = self.ptr
+        return (i for i in range(self.n) if ptr[i + 1] > ptr[i])
+
+    def items(self):
+        return ((i, self.idx[self.ptr[i]:self.ptr[i + 1]]) for i in self)
+
+
+class _RecipeTable:
+    """recipe id -> recipe dict, decoded on access; iterates ids in catalog order."""
+
+    def __init__(self, recipe_ids, meta_ptr, meta):
+        self.recipe_ids = recipe_ids
+        self.meta_ptr = meta_ptr
+        self.meta = meta
+        self._row = _row_finder(recipe_ids)
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def __iter__(self):
+        return iter(self.recipe_ids)
+
+    def __contains__(self, r_id):
+        return self._row(r_id) is not None
+
+    def __getitem__(self, r_id):
+        row = self._row(r_id)
+        if row is None:
+            raise KeyError(r_id)
+        name, cuisine, servings = json.loads(bytes(self.meta[self.meta_ptr[row]:self.meta_ptr[row + 1]]))
+        return {'id': r_id, 'name': name, 'cuisine': cuisine, 'servings': servings}
+
+    def get(self, r_id, default=None):
+        try:
+            return self[r_id]
+        except KeyError:
+            return default
+
+    def values(self):
+        return (self[r_id] for r_id in self.recipe_ids)
+
+    def items(self):
+        return ((r_id, self[r_id]) for r_id in self.recipe_ids)
+
+
+class MappedSubstitutes:
+    """find_substitute_ids answered from the precomputed edges of a snapshot file."""
+
+    def __init__(self, vocab, limit, ptr, ids, scores, reasons, chain_ptr, chain_idx):
+        self.vocab = vocab
+        self.limit = limit
+        self.ptr = ptr
+        self.ids = ids
+        self.scores = scores
+        self.reasons = reasons
+        self.chain_ptr = chain_ptr
+        self.chain_idx = chain_idx
+        # decoded edge tuples; only ingredients that actually go missing in pantries end up here
+        self._cache = {}
+
+    def find_substitute_ids(self, ingredient_id, limit=6):
+        cached = self._cache.get(ingredient_id)
+        if cached is not None and limit == self.limit:
+            return cached
+        if limit != self.limit:
+            raise ValueError(f"snapshot holds substitutes at limit {self.limit}, not {limit}")
+        if not 0 <= ingredient_id < len(self.ptr) - 1:
+            return _EMPTY
+        lo, hi = self.ptr[ingredient_id], self.ptr[ingredient_id + 1]
+        cached = tuple((self.ids[k], self.scores[k], REASONS[self.reasons[k]]) for k in range(lo, hi))
+        self._cache[ingredient_id] = cached
+        return cached
+
+    def find_substitutes(self, ingredient_name, limit=6):
+        """Name-keyed variant; only recipe ingredients have stored substitutes."""
+        i = self.vocab.id_of(ingredient_name.strip().lower())
+        if i is None:
+            return []
+        return [(self.vocab.name_of(s), score, reason) for s, score, reason in self.find_substitute_ids(i, limit)]
+
+    def find_chain(self, ingredient_name, substitute_name):
+        """Ingredient names along a stored chain edge, or None."""
+        i = self.vocab.id_of(ingredient_name.strip().lower())
+        sub = self.vocab.id_of(substitute_name.strip().lower())
+        if i is None or sub is None or not 0 <= i < len(self.ptr) - 1:
+            return None
+        for k in range(self.ptr[i], self.ptr[i + 1]):
+            if self.ids[k] == sub and REASONS[self.reasons[k]] == 'chain':
+                return [self.vocab.name_of(c) for c in self.chain_idx[self.chain_ptr[k]:self.chain_ptr[k + 1]]]
+        return None
+
+
+class MappedSnapshot:
+    """
+    A snapshot file mapped read-only, with the attributes RecipeMatcher reads from a
+    CatalogSnapshot. Index lookups return memoryview slices of the mapping (no copies);
+    only the ingredient vocabulary and popularity are materialised per process.
+    """
+
+    def __init__(self, path, version=1):
+        self.path = os.path.abspath(path)
+        self.header = header = read_header(self.path)
+        if header.get('format') != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported snapshot format {header.get('format')}")
+        if header.get('byteorder') != sys.byteorder:
+            raise ValueError(f"{path}: snapshot was written on a {header.get('byteorder')}-endian machine")
+        with open(self.path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (size,) = struct.unpack_from('<I', self._mm, len(MAGIC))
+        self._base = _align(len(MAGIC) + 4 + size)
+        self._buf = memoryview(self._mm)
+        section = self.section
+
+        names = bytes(section('names'))
+        names_ptr = section('names_ptr')
+        self.vocab = IngredientVocab()
+        for k in range(len(names_ptr) - 1):
+            self.vocab.intern(names[names_ptr[k]:names_ptr[k + 1]].decode('utf-8'))
+
+        recipe_ids = section('recipe_ids')
+        self.recipes = _RecipeTable(recipe_ids, section('meta_ptr'), section('meta'))
+        self.req_ings = _RowIndex(recipe_ids, section('req_ptr'), section('req_idx'))
+        self.opt_ings = _RowIndex(recipe_ids, section('opt_ptr'), section('opt_idx'))
+        self.postings = _DenseIndex(section('post_ptr'), section('post_idx'))
+        self.req_postings = _DenseIndex(section('req_post_ptr'), section('req_post_idx'))
+        self.substitutes_for = _DenseIndex(section('subfor_ptr'), section('subfor_idx'))
+        self.always_candidates = section('always')
+        self.ingredient_popularity = {i: n for i, n in enumerate(section('popularity')) if n}
+        self.subst = MappedSubstitutes(self.vocab, header['subst_limit'], section('sub_ptr'), section('sub_ids'),
+                                       section('sub_scores'), section('sub_reasons'), section('chain_ptr'),
+                                       section('chain_idx'))
+        self.stats = CatalogStats.restore(version, self.vocab, len(recipe_ids), self.ingredient_popularity,
+                                          header['required_links'], header['optional_links'], header['built_at'])
+        self.vector = None
+        self.gap_scorer = None
+
+    def section(self, name):
+        """A named array of the file, as a typed memoryview of the mapping."""
+        offset, typecode, count = self.header['sections'][name]
+        start = self._base + offset
+        return self._buf[start:start + count * array(typecode).itemsize].cast(typecode)
@@ -1,15 +1,144 @@
 # substitution.py
-import sqlite3
 import os
+import time
+from collections import defaultdict
+from itertools import islice
+from vocab import IngredientVocab
+from db import pool_for
 
 class SubstitutionEngine:
-    def __init__(self, db_path='data/recipes.db'):
+    DEFAULT_LIMIT = 6
+    # bound on memoized lookups so arbitrary query strings can't grow memory forever
+    CACHE_LIMIT = 100000
+    # multi-hop substitution: chains of up to MAX_HOPS explicit substitutions, scored as the
+    # product of their edge scores times CHAIN_DECAY for every hop after the first
+    MAX_HOPS = 3
+    CHAIN_DECAY = 0.8
+    CHAIN_MIN_SCORE = 0.3
+
+    def __init__(self, db_path='data/recipes.db', vocab=None, metrics=None):
+        """
+        vocab: IngredientVocab to intern ingredient names into (shared with the matcher)
+        metrics: optional Metrics registry; lookups that miss the memo are counted and timed
+        """
         self.db_path = os.path.abspath(db_path)
         if not os.path.exists(self.db_path):
             raise FileNotFoundError(f"SubstitutionEngine: DB not found at {self.db_path}")
+        self.vocab = vocab if vocab is not None else IngredientVocab()
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.describe('substitute_computes_total', 'counter',
+                             "find_substitutes lookups computed from the graph (memo misses).")
+            metrics.describe('substitute_compute_seconds', 'histogram', "Time to compute one uncached lookup.")
+        self._load_graph()
 
     def _conn(self):
-        return sqlite3.connect(self.db_path)
+        # the calling thread's pooled connection: inside RecipeMatcher's load transaction when it builds us
+        return pool_for(self.db_path).connection()
+
+    def _load_graph(self):
+        """
+        Load the substitution graph into memory once:
+         - ingredients in table order (drives category and substring matches)
+         - direct edges from the substitutions table, best score first
+         - category -> sibling ingredients
+        """
+        self.ingredients = []                # (id, lower name, raw name, category) in table order
+        self.by_raw_name = []                # same rows sorted by name (substring scan order)
+        self.by_name = {}                    # lower name -> (id, category); first row wins
+        self.by_category = defaultdict(list)  # category -> [(id, lower name)]
+        self.direct = defaultdict(list)      # ingredient id -> [(substitute lower name, score)]
+        self.chains = {}                     # ingredient id -> [(substitute lower name, score, path names)]
+        self._substring = {}                 # query -> [(id, lower name, raw name)] containing it
+        self._cache = {}                     # (query, limit) -> find_substitutes result
+        self._id_cache = {}                  # (ingredient id, limit) -> find_substitute_ids result
+
+        conn = self._conn()
+        cur = conn.cursor()
+        cur.execute('SELECT id, name, category FROM ingredients ORDER BY id')
+        for ing_id, name, category in cur.fetchall():
+            lname = name.lower()
+            self.vocab.intern(lname)
+            self.ingredients.append((ing_id, lname, name, category))
+            self.by_name.setdefault(lname, (ing_id, category))
+            if category is not None:
+                self.by_category[category].append((ing_id, lname))
+
+        cur.execute('''SELECT s.ingredient_id, i2.name, s.score FROM substitutions s
+                       JOIN ingredients i2 ON i2.id = s.substitute_id ORDER BY s.id''')
+        for ing_id, name, score in cur.fetchall():
+            self.direct[ing_id].append((name.lower(), float(score)))
+
+        # the fuzzy LIKE query this replaces walked the unique index on name, so fuzzy
+        # matches come back in name order rather than table order
+        self.by_raw_name = sorted(self.ingredients, key=lambda x: x[2])
+        for edges in self.direct.values():
+            edges.sort(key=lambda x: x[1], reverse=True)
+        self._build_chains()
+
+    def _build_chains(self):
+        """
+        Precompute the best chain of 2..MAX_HOPS direct substitutions out of every ingredient
+        that has any: a hop-bounded Bellman-Ford on -log(score), i.e. maximising the product.
+        Scores only shrink along a chain, so a node is expanded again only when it improved.
+        """
+        name_of = {i_id: lname for i_id, lname, _, _ in self.ingredients}
+        for src in list(self.direct):
+            best = {src: (1.0, (src,))}   # ingredient id -> (score, path) over chains of <= hop edges
+            frontier = [src]
+            for hop in range(1, self.MAX_HOPS + 1):
+                decay = self.CHAIN_DECAY if hop > 1 else 1.0
+                improved = {}
+                for u in frontier:
+                    u_score, u_path = best[u]
+                    for name, score in self.direct.get(u, ()):
+                        v = self.by_name[name][0]
+                        chain_score = u_score * score * decay
+                        if v in u_path or chain_score < self.CHAIN_MIN_SCORE:
+                            continue
+                        current = improved.get(v) or best.get(v)
+                        if current is None or chain_score > current[0]:
+                            improved[v] = (chain_score, u_path + (v,))
+                if not improved:
+                    break
+                best.update(improved)
+                frontier = list(improved)
+            chains = [(name_of[path[-1]], round(chain_score, 4), tuple(name_of[i] for i in path))
+                      for chain_score, path in best.values() if len(path) > 2]
+            if chains:
+                chains.sort(key=lambda x: x[1], reverse=True)
+                self.chains[src] = chains
+
+    def _substring_matches(self, ing):
+        # ingredients whose lowercased name contains ing, in name order (memoized)
+        matches = self._substring.get(ing)
+        if matches is None:
+            matches = [(i_id, lname, name) for i_id, lname, name, _ in self.by_raw_name if ing in lname]
+            if len(self._substring) >= self.CACHE_LIMIT:
+                self._substring.clear()
+            self._substring[ing] = matches
+        return matches
+
+    def neighbors(self, ingredient_name):
+        """Precomputed substitutes at the default limit; O(1) once warmed."""
+        return self.find_substitutes(ingredient_name, limit=self.DEFAULT_LIMIT)
+
+    def warm(self, ingredient_names, limit=DEFAULT_LIMIT):
+        """Precompute lookups for a known vocabulary (e.g. every recipe ingredient)."""
+        for name in ingredient_names:
+            self.find_substitutes(name, limit=limit)
+
+    def find_substitute_ids(self, ingredient_id, limit=6):
+        """find_substitutes keyed and answered with vocabulary ids: ((substitute_id, score, reason), ...)"""
+        key = (ingredient_id, limit)
+        cached = self._id_cache.get(key)
+        if cached is None:
+            names = self.find_substitutes(self.vocab.name_of(ingredient_id), limit=limit)
+            cached = tuple((self.vocab.intern(n), score, reason) for n, score, reason in names)
+            if len(self._id_cache) >= self.CACHE_LIMIT:
+                self._id_cache.clear()
+            self._id_cache[key] = cached
+        return cached
 
     def find_substitutes(self, ingredient_name, limit=6):
         """
@@ -18,49 +147,77 @@ class SubstitutionEngine:
          - direct explicit substitutes from substitutions table (best)
          - same-category substitutes (look up ingredients with same category)
          - fuzzy substring matches (e.g., 'oil' -> 'olive oil' or 'cooking oil')
+         - chains of direct substitutes (ghee -> butter -> margarine) where they outscore the above
         """
         ing = ingredient_name.strip().lower()
-        conn = self._conn()
-        cur = conn.cursor()
+        key = (ing, limit)
+        cached = self._cache.get(key)
+        if cached is None:
+            t0 = time.perf_counter()
+            cached = self._compute(ing, limit)
+            if self.metrics is not None:
+                self.metrics.inc('substitute_computes_total')
+                self.metrics.observe('substitute_compute_seconds', time.perf_counter() - t0)
+            if len(self._cache) >= self.CACHE_LIMIT:
+                self._cache.clear()
+            self._cache[key] = cached
+        return list(cached)
+
+    def find_chain(self, ingredient_name, substitute_name):
+        """Ingredient names along the precomputed chain from ingredient to substitute, or None."""
+        row = self._resolve(ingredient_name.strip().lower())
+        if row is None:
+            return None
+        sub = substitute_name.strip().lower()
+        for name, _, path in self.chains.get(row[0], ()):
+            if name == sub:
+                return list(path)
+        return None
 
+    def _resolve(self, ing):
+        row = self.by_name.get(ing)
+        if row:
+            return row
+        # fallback: first ingredient (in table order) whose name contains ing; as with the
+        # original (id, name, category) row lookup, its name is what gets used as the category
+        matches = self._substring_matches(ing)
+        if not matches:
+            return None
+        ing_id, _, category = min(matches)
+        return ing_id, category
+
+    def _compute(self, ing, limit):
         # 1) find ingredient id and category
-        cur.execute("SELECT id, category FROM ingredients WHERE lower(name)=?", (ing,))
-        row = cur.fetchone()
-        if not row:
-            # fallback: try substring match for ingredient name
-            cur.execute("SELECT id, name, category FROM ingredients WHERE lower(name) LIKE ? LIMIT 1", (f"%{ing}%",))
-            row = cur.fetchone()
-        if not row:
-            conn.close()
-            return []
-
-        ing_id, category = row[0], row[1] if row and len(row) > 1 else None
+        row = self._resolve(ing)
+        if row is None:
+            return ()
+        ing_id, category = row
 
         results = []
         # 2) direct substitutions table
-        cur.execute('''SELECT i2.name, s.score FROM substitutions s
-                       JOIN ingredients i2 ON i2.id = s.substitute_id
-                       WHERE s.ingredient_id = ? ORDER BY s.score DESC LIMIT ?''', (ing_id, limit))
-        for name, score in cur.fetchall():
-            results.append((name.lower(), float(score), 'direct'))
+        for name, score in self.direct.get(ing_id, [])[:limit]:
+            results.append((name, score, 'direct'))
 
         # 3) same-category substitutes (if not too many results already)
         if category:
             needed = limit - len(results)
             if needed > 0:
-                cur.execute('''SELECT name FROM ingredients WHERE category=? AND id != ? LIMIT ?''', (category, ing_id, needed))
-                for (name,) in cur.fetchall():
+                siblings = (name for i_id, name in self.by_category.get(category, []) if i_id != ing_id)
+                for name in islice(siblings, needed):
                     # assign a modest default score for category match
-                    results.append((name.lower(), 0.45, 'category'))
+                    results.append((name, 0.45, 'category'))
 
         # 4) fuzzy substring (e.g., 'oil' -> 'olive oil', 'cooking oil')
         needed = limit - len(results)
         if needed > 0:
-            cur.execute("SELECT name FROM ingredients WHERE lower(name) LIKE ? AND id != ? LIMIT ?", (f"%{ing}%", ing_id, needed))
-            for (name,) in cur.fetchall():
-                results.append((name.lower(), 0.4, 'fuzzy'))
+            fuzzy = (lname for i_id, lname, _ in self._substring_matches(ing) if i_id != ing_id)
+            for name in islice(fuzzy, needed):
+                results.append((name, 0.4, 'fuzzy'))
+
+        # 5) multi-hop chains; appended last so they only displace lower-scoring substitutes
+        for name, score, _ in self.chains.get(ing_id, ())[:limit]:
+            results.append((name, score, 'chain'))
 
-        conn.close()
         # deduplicate preserving best score
         dedup = {}
         for name, score, reason in results:
@@ -69,4 +226,4 @@ class SubstitutionEngine:
         out = [(n, dedup[n][0], dedup[n][1]) for n in dedup]
         # sort by score desc
         out.sort(key=lambda x: x[1], reverse=True)
-        return out[:limit]
+        return tuple(out[:limit])
@@ -0,0 +1,19 @@
+# suggest_worker.py
+"""
+Process-pool side of asgi_app's ASGI_EXECUTOR=process mode: one matcher per worker process,
+mapped read-only from the catalog snapshot the ASGI process publishes. Kept apart from
+asgi_app so spawned workers import only this and recipe_matching, not the Flask app.
+"""
+
+_matcher = None
+
+def init(db_path, snapshot_path, engine, reload_interval):
+    global _matcher
+    from recipe_matching import RecipeMatcher
+    _matcher = RecipeMatcher(db_path, engine=engine, snapshot_path=snapshot_path)
+    if reload_interval > 0:
+        # re-maps the snapshot when it is replaced; recipes.db itself is only read by the publisher
+        _matcher.start_watcher(reload_interval)
+
+def suggest(pantry, max_results, include_zero_overlap):
+    return _matcher.suggest(pantry, max_results=max_results, include_zero_overlap=include_zero_overlap)
@@ -0,0 +1,116 @@
+# test_asgi.py
+"""RequestCoalescer and the async /api/suggest of asgi_app (thread executor, seed catalog)."""
+import asyncio
+import json
+import os
+
+# the app module loads data/recipes.db on import; keep it from writing the index cache or polling
+os.environ.setdefault('CATALOG_INDEX', '')
+os.environ.setdefault('CATALOG_RELOAD_INTERVAL', '0')
+
+import pytest  # noqa: E402
+
+import asgi_app  # noqa: E402
+from asgi_app import RequestCoalescer, SuggestApp  # noqa: E402
+
+
+def test_coalescer_shares_one_computation_per_key():
+    coalescer = RequestCoalescer()
+    calls = []
+
+    async def main():
+        release = asyncio.Event()
+
+        def compute_for(key):
+            async def compute():
+                calls.append(key)
+                await release.wait()
+                return key * 2
+            return compute
+
+        waiters = [asyncio.ensure_future(coalescer.run(key, compute_for(key))) for key in (1, 1, 2, 1)]
+        await asyncio.sleep(0)
+        assert coalescer.stats()['in_flight'] == 2
+        release.set()
+        return await asyncio.gather(*waiters)
+
+    assert asyncio.run(main()) == [2, 2, 4, 2]
+    assert sorted(calls) == [1, 2]
+    assert coalescer.stats() == {'computed': 2, 'coalesced': 2, 'coalesce_rate': 0.5, 'in_flight': 0}
+
+
+def test_coalescer_failure_reaches_every_caller_and_frees_the_key():
+    coalescer = RequestCoalescer()
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise ValueError("boom")
+
+    async def ok():
+        return 'ok'
+
+    async def main():
+        results = await asyncio.gather(coalescer.run('k', fail), coalescer.run('k', fail), return_exceptions=True)
+        assert [type(r) for r in results] == [ValueError, ValueError]
+        return await coalescer.run('k', ok)
+
+    assert asyncio.run(main()) == 'ok'
+    assert coalescer.stats()['computed'] == 2
+
+
+def test_coalescer_caller_cancellation_keeps_the_computation():
+    coalescer = RequestCoalescer()
+
+    async def main():
+        release = asyncio.Event()
+
+        async def compute():
+            await release.wait()
+            return 'done'
+
+        first = asyncio.ensure_future(coalescer.run('k', compute))
+        second = asyncio.ensure_future(coalescer.run('k', compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == 'done'
+
+
+async def request(app, path, body, method='POST'):
+    messages = [{'type': 'http.request', 'body': json.dumps(body).encode()}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await app({'type': 'http', 'path': path, 'method': method}, receive, send)
+    return sent[0]['status'], json.loads(sent[1]['body'])
+
+
+def test_suggest_endpoint():
+    matcher = asgi_app.flask_app.matcher
+    app = SuggestApp(executor_kind='thread', workers=2)
+
+    async def main():
+        pantry = {'ingredients': [' Onion', 'tomato', 'onion']}
+        results = await asyncio.gather(*[request(app, '/api/suggest', pantry) for _ in range(5)])
+        assert results == [(200, matcher.suggest(['onion', 'tomato']))] * 5
+        everything = {'ingredients': ['onion'], 'include_zero_overlap': True}
+        assert await request(app, '/api/suggest', dict(everything, max_results=-3)) == (200, [])
+        status, body = await request(app, '/api/suggest', dict(everything, max_results=10 ** 9))
+        assert status == 200 and len(body) == len(matcher.recipes)
+        assert (await request(app, '/api/suggest', {'max_results': 'many'}))[0] == 400
+        return await request(app, '/api/suggest/coalesce-stats', None, method='GET')
+
+    try:
+        status, stats = asyncio.run(main())
+    finally:
+        app.shutdown()
+    assert status == 200 and (stats['computed'], stats['coalesced']) == (3, 4)
@@ -0,0 +1,98 @@
+# test_ingest.py
+"""Readers and CatalogLoader of ingest.py, and an ingest into a new DB served by the matcher."""
+import io
+import json
+import sqlite3
+
+from ingest import CatalogLoader, ingest, read_csv, read_jsonl, read_records
+from recipe_matching import RecipeMatcher
+from schema import create_catalog
+
+
+def catalog():
+    conn = sqlite3.connect(':memory:')
+    create_catalog(conn)
+    return conn
+
+
+def ingredient_names(conn):
+    return sorted(name for name, in conn.execute('SELECT name FROM ingredients'))
+
+
+def links(conn, recipe):
+    return sorted(conn.execute(
+        'SELECT i.name, ri.qty, ri.unit, ri.optional FROM recipe_ingredients ri '
+        'JOIN ingredients i ON i.id = ri.ingredient_id JOIN recipes r ON r.id = ri.recipe_id '
+        'WHERE r.name = ?', (recipe,)))
+
+
+def test_read_jsonl_skips_malformed_lines():
+    f = io.StringIO('{"name": "Poha", "ingredients": ["poha"]}\n\nnot json\n[1, 2]\n{"name": "Upma"}\n')
+    assert list(read_jsonl(f)) == [{'name': 'Poha', 'ingredients': ['poha']}, {}, {}, {'name': 'Upma'}]
+
+
+def test_read_csv_one_row_per_recipe():
+    f = io.StringIO('name,cuisine,servings,ingredients\n'
+                    'Poha,Marathi,2,poha; onion ;peanuts\n'
+                    'Upma,,,"[""rava"", ""onion""]"\n')
+    records = list(read_csv(f))
+    assert [r['name'] for r in records] == ['Poha', 'Upma']
+    assert records[0]['ingredients'] == ['poha', ' onion ', 'peanuts']
+    assert records[1]['ingredients'] == ['rava', 'onion']
+
+
+def test_read_csv_one_row_per_ingredient():
+    f = io.StringIO('recipe_id,name,ingredient,qty,unit,optional\n'
+                    '1,Poha,poha,100,g,\n'
+                    '1,Poha,peanuts,30,g,yes\n'
+                    '2,Upma,rava,80,g,0\n')
+    records = list(read_csv(f))
+    assert [(r['name'], [i['name'] for i in r['ingredients']]) for r in records] == \
+        [('Poha', ['poha', 'peanuts']), ('Upma', ['rava'])]
+    assert records[0]['ingredients'][1]['optional'] == 'yes'
+
+
+def test_loader_normalizes_and_merges_ingredients():
+    conn = catalog()
+    loader = CatalogLoader(conn).add_all([
+        {'name': 'Poha', 'ingredients': [' Poha ', {'name': 'peanuts', 'qty': '30', 'unit': 'g', 'optional': 'yes'},
+                                         {'name': 'PEANUTS', 'qty': 40, 'unit': 'g'}]},
+        {'name': 'Peanut Chikki', 'ingredients': ['peanuts', 'jaggery']},
+        {'name': '', 'ingredients': ['ignored']},
+    ])
+    assert (loader.recipes, loader.new_ingredients, loader.skipped) == (2, 3, 1)
+    assert ingredient_names(conn) == ['jaggery', 'peanuts', 'poha']
+    # a required mention wins over an optional one of the same ingredient
+    assert links(conn, 'Poha') == [('peanuts', 40.0, 'g', 0), ('poha', None, None, 0)]
+
+
+def test_loader_splits_string_ingredients():
+    conn = catalog()
+    loader = CatalogLoader(conn).add_all([
+        {'name': 'Rice Bowl', 'ingredients': 'rice; onion'},
+        {'name': 'Dal', 'ingredients': '["toor dal", "salt"]'},
+        {'name': 'Broken', 'ingredients': {'rice': 1}},
+        {'name': 'Also Broken', 'ingredients': 42},
+    ])
+    assert (loader.recipes, loader.skipped) == (2, 2)
+    assert ingredient_names(conn) == ['onion', 'rice', 'salt', 'toor dal']
+    assert [name for name, *_ in links(conn, 'Rice Bowl')] == ['onion', 'rice']
+
+
+def test_ingest_new_db_is_served_and_logged(tmp_path):
+    db_path = str(tmp_path / 'recipes.db')
+    records = [{'name': 'Poha', 'ingredients': ['poha', 'onion']},
+               {'name': 'Rice Bowl', 'ingredients': 'rice; onion'}]
+    summary = ingest(db_path, records)
+    assert (summary['recipes'], summary['links'], summary['new_ingredients']) == (2, 4, 3)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT entity FROM catalog_changes").fetchall() == [('catalog',)]
+    conn.close()
+
+    matcher = RecipeMatcher(db_path)
+    assert [r['name'] for r in matcher.suggest(['rice', 'onion'])] == ['Rice Bowl', 'Poha']
+    jsonl = tmp_path / 'more.jsonl'
+    jsonl.write_text(json.dumps({'name': 'Onion Rice', 'ingredients': ['onion', 'rice']}) + '\n')
+    ingest(db_path, read_records(str(jsonl)))
+    assert matcher.reload_if_changed()
+    assert len(matcher.recipes) == 3
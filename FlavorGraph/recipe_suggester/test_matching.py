@@ -0,0 +1,139 @@
+# test_matching.py
+"""
+Equivalence checks on a generated catalog: the alternative ways of serving suggest (vector
+engine, incremental reload, mapped snapshot files) must answer exactly like a fresh
+python-engine load of the same DB.
+"""
+import random
+import sqlite3
+
+import pytest
+
+from benchmark import generate_catalog, ingredient_name
+from recipe_matching import RecipeMatcher
+from schema import install_change_log
+from snapshot_file import MappedSnapshot
+from vector_scoring import np
+
+RECIPES = 2000
+INGREDIENTS = 300
+
+OPTIONS = [{}, {'allow_subst': False}, {'include_zero_overlap': True, 'max_results': 7}]
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    db_path = str(tmp_path / 'recipes.db')
+    generate_catalog(db_path, recipes=RECIPES, ingredients=INGREDIENTS, seed=7)
+    conn = sqlite3.connect(db_path)
+    install_change_log(conn)
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def pantries(n=40, seed=1):
+    # mostly popular ingredients (low ids under the Zipf sampler), plus the odd unknown name
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        pantry = [ingredient_name(rng.randrange(rng.choice([20, 100, INGREDIENTS]))) for _ in range(rng.randint(1, 8))]
+        if rng.random() < 0.2:
+            pantry.append('not an ingredient')
+        out.append(pantry)
+    return out
+
+
+def assert_same_suggestions(expected, actual):
+    for pantry in pantries():
+        for options in OPTIONS:
+            assert actual.suggest(pantry, **options) == expected.suggest(pantry, **options), (pantry, options)
+
+
+def test_vector_engine_matches_python(catalog):
+    if np is None:
+        pytest.skip("vector engine needs numpy and scipy")
+    python = RecipeMatcher(catalog)
+    vector = RecipeMatcher(catalog, engine='vector')
+    assert_same_suggestions(python, vector)
+    batch = pantries(10, seed=2)
+    expected = python.suggest_batch(batch)
+    assert vector.suggest_batch(batch) == expected
+    # a batch split over several scoring passes by the cell budget
+    vector.snapshot.vector.SCORE_CELLS = 3 * RECIPES
+    assert vector.suggest_batch(batch) == expected
+    for pantry in batch:
+        assert vector.shopping_plan(pantry, max_items=3) == python.shopping_plan(pantry, max_items=3)
+
+
+def test_shopping_plan_fallback_matches_vector_gaps(catalog, monkeypatch):
+    if np is None:
+        pytest.skip("python-engine shopping plans only use a VectorScorer with numpy and scipy")
+    python = RecipeMatcher(catalog)
+    fallback = RecipeMatcher(catalog)
+    monkeypatch.setattr(fallback, '_gap_scorer', lambda snap: None)
+    for pantry in pantries(10, seed=4):
+        for allow_subst in (True, False):
+            expected = fallback.shopping_plan(pantry, max_items=3, allow_subst=allow_subst)
+            assert python.shopping_plan(pantry, max_items=3, allow_subst=allow_subst) == expected
+    assert python.snapshot.gap_scorer is not None and fallback.snapshot.gap_scorer is None
+
+
+def test_incremental_reload_matches_fresh_load(catalog, monkeypatch):
+    matcher = RecipeMatcher(catalog)
+    conn = sqlite3.connect(catalog)
+    # a new recipe using a new ingredient and an existing one
+    conn.execute("INSERT INTO ingredients (name, category, unit) VALUES ('saffron', 'spice', 'g')")
+    r_id = conn.execute("INSERT INTO recipes (name, cuisine) VALUES ('Saffron Rice', 'Test')").lastrowid
+    conn.executemany("INSERT INTO recipe_ingredients (recipe_id, ingredient_id, qty, unit, optional) "
+                     "VALUES (?, (SELECT id FROM ingredients WHERE name = ?), 1, 'g', ?)",
+                     [(r_id, 'saffron', 0), (r_id, ingredient_name(0), 0), (r_id, ingredient_name(1), 1)])
+    # an existing recipe loses an ingredient, another one is deleted outright
+    conn.execute("DELETE FROM recipe_ingredients WHERE recipe_id = 5 AND ingredient_id = "
+                 "(SELECT MIN(ingredient_id) FROM recipe_ingredients WHERE recipe_id = 5)")
+    conn.execute("DELETE FROM recipe_ingredients WHERE recipe_id = 9")
+    conn.execute("DELETE FROM recipes WHERE id = 9")
+    # the substitution graph changes
+    conn.execute("UPDATE substitutions SET score = 0.99 WHERE id = (SELECT MIN(id) FROM substitutions)")
+    conn.execute("INSERT INTO substitutions (ingredient_id, substitute_id, score) VALUES (2, 3, 0.9)")
+    conn.commit()
+    conn.close()
+
+    def no_full_rebuild(*args, **kwargs):
+        raise AssertionError("reload rebuilt the whole catalog")
+    monkeypatch.setattr(matcher, '_build_snapshot', no_full_rebuild)
+    assert matcher.reload()
+    monkeypatch.undo()
+
+    fresh = RecipeMatcher(catalog)
+    assert len(matcher.recipes) == len(fresh.recipes) == RECIPES
+    assert_same_suggestions(fresh, matcher)
+    assert [r['name'] for r in matcher.suggest(['saffron'])] == ['Saffron Rice']
+    assert not matcher.reload()
+
+
+def test_mapped_snapshot_matches_in_memory(catalog, tmp_path):
+    matcher = RecipeMatcher(catalog)
+    snapshot_path = str(tmp_path / 'catalog.snap')
+    matcher.save_snapshot(snapshot_path)
+    mapped = RecipeMatcher(catalog, snapshot_path=snapshot_path)
+    assert isinstance(mapped.snapshot, MappedSnapshot)
+    assert_same_suggestions(matcher, mapped)
+    assert mapped.catalog_stats() == matcher.catalog_stats()
+    batch = pantries(10, seed=3)
+    assert mapped.suggest_batch(batch) == matcher.suggest_batch(batch)
+    if np is not None:
+        # the vector engine wraps the mapped CSR sections instead of rebuilding its matrices
+        mapped_vector = RecipeMatcher(catalog, engine='vector', snapshot_path=snapshot_path)
+        assert np.shares_memory(mapped_vector.snapshot.vector.R.indices,
+                                np.frombuffer(mapped_vector.snapshot.section('req_idx'), dtype=np.int32))
+        assert_same_suggestions(matcher, mapped_vector)
+        assert mapped_vector.suggest_batch(batch) == matcher.suggest_batch(batch)
+
+
+def test_suggest_timing_stages(catalog):
+    matcher = RecipeMatcher(catalog)
+    timing = {}
+    matcher.suggest(pantries(1)[0], timing=timing)
+    assert list(timing['stages_ms']) == ['normalize', 'candidates', 'substitute', 'score', 'select', 'detail']
+    assert timing['counts']['recipes_scanned'] > 0
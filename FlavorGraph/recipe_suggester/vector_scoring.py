@@ -0,0 +1,223 @@
+# vector_scoring.py
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # optional dependency, only needed for RecipeMatcher(engine='vector')
+    np = None
+    sparse = None
+
+from snapshot_file import MappedSnapshot
+
+class VectorScorer:
+    """
+    Scores every recipe of a catalog snapshot at once.
+    Recipes are rows of sparse CSR incidence matrices (required, optional) over the ingredient
+    vocabulary ids and the pantry is a 0/1 vector, so the per-recipe terms of the score are a few
+    matrix-vector products. Floating point sums may differ from the per-recipe loop in the
+    last bits, so the top-k is only used as a shortlist that the matcher rescores exactly.
+    """
+    # slack when cutting the shortlist so rounding differences can't drop a tied recipe
+    EPS = 1e-9
+    # dense score cells (recipes x pantries) per scoring pass; a batch is scored in as many
+    # passes as it takes to stay under it (each of the ~4 live float64 arrays is 8 bytes a cell)
+    SCORE_CELLS = 1 << 21
+
+    def __init__(self, snap, subst_limit=6):
+        if np is None:
+            raise ImportError("VectorScorer requires numpy and scipy (pip install numpy scipy)")
+        if isinstance(snap, MappedSnapshot):
+            self._wrap_mapped(snap, subst_limit)
+        else:
+            self._build(snap, subst_limit)
+        n_ing = self.n_ing
+        self.req_len = np.asarray(self.R.sum(axis=1)).ravel()
+        self.opt_len = np.asarray(self.O.sum(axis=1)).ravel()
+        self.req_count = np.maximum(1.0, self.req_len)
+        self._nnz_row = None   # row of each nonzero of R, built on first purchase_gaps
+
+        # per-ingredient rarity weight (0.05 * rarity) used by the rarity bonus, folded into R
+        rarity_w = np.array([0.05 * snap.stats.rarity_of(j) for j in range(n_ing)])
+        self.R_rarity = (self.R @ sparse.diags(rarity_w)).tocsr()
+
+    def _build(self, snap, subst_limit):
+        self.recipe_ids = np.array(list(snap.recipes), dtype=np.int64)
+        row_of = {r_id: i for i, r_id in enumerate(snap.recipes)}
+
+        # columns are ingredient vocabulary ids; ids interned after this build can't
+        # appear in any recipe or substitution of the snapshot, so pantries just skip them
+        self.n_ing = n_ing = len(snap.vocab)
+        n_rec = len(self.recipe_ids)
+        self.R = self._incidence(snap.req_ings, row_of, n_rec, n_ing)
+        self.O = self._incidence(snap.opt_ings, row_of, n_rec, n_ing)
+
+        # B[m, s] = 1 when s is a usable (score > 0) substitute for recipe ingredient m
+        rows, cols = [], []
+        for m in snap.req_postings:
+            for sub, score, reason in snap.subst.find_substitute_ids(m, limit=subst_limit):
+                if score > 0:
+                    rows.append(m)
+                    cols.append(sub)
+        self.B = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n_ing, n_ing))
+        self.subst_pairs = (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64))
+
+    def _wrap_mapped(self, snap, subst_limit):
+        """
+        The CSR sections of a snapshot file already are R, O and B: their ingredient ids are
+        used in place (read-only, shared through the page cache), only offsets and 1.0 values
+        are allocated. Columns are the vocabulary the file was written with.
+        """
+        if snap.subst.limit != subst_limit:
+            raise ValueError(f"snapshot holds substitutes at limit {snap.subst.limit}, not {subst_limit}")
+        self.recipe_ids = np.frombuffer(snap.section('recipe_ids'), dtype=np.int32).astype(np.int64)
+        sub_ptr = np.frombuffer(snap.section('sub_ptr'), dtype=np.int64)
+        self.n_ing = n_ing = len(sub_ptr) - 1
+        n_rec = len(self.recipe_ids)
+        self.R = self._mapped_csr(snap.section('req_ptr'), snap.section('req_idx'), (n_rec, n_ing))
+        self.O = self._mapped_csr(snap.section('opt_ptr'), snap.section('opt_idx'), (n_rec, n_ing))
+
+        # substitute edges are stored for every recipe ingredient; B keeps the usable (score > 0) ones
+        rows = np.repeat(np.arange(n_ing, dtype=np.int64), np.diff(sub_ptr))
+        cols = np.frombuffer(snap.section('sub_ids'), dtype=np.int32)
+        usable = np.frombuffer(snap.section('sub_scores'), dtype=np.float64) > 0
+        if usable.all():
+            self.B = self._mapped_csr(snap.section('sub_ptr'), snap.section('sub_ids'), (n_ing, n_ing))
+        else:
+            rows, cols = rows[usable], cols[usable]
+            self.B = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n_ing, n_ing))
+        self.subst_pairs = (rows, cols.astype(np.int64))
+
+    @staticmethod
+    def _mapped_csr(ptr, idx, shape):
+        indices = np.frombuffer(idx, dtype=np.int32)
+        indptr = np.frombuffer(ptr, dtype=np.int64)
+        if len(indices) < 2 ** 31:
+            # scipy wants one index dtype; narrowing the offsets copies them but leaves the ids mapped
+            indptr = indptr.astype(np.int32)
+        return sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape=shape)
+
+    def _incidence(self, ings_by_recipe, row_of, n_rec, n_ing):
+        rows, cols = [], []
+        for r_id, ings in ings_by_recipe.items():
+            rows.extend([row_of[r_id]] * len(ings))
+            cols.extend(ings)
+        return sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n_rec, n_ing))
+
+    def pantry_matrix(self, pantries):
+        """Sparse 0/1 matrix with one column per pantry of ingredient ids (unknown ids are ignored)."""
+        rows, cols = [], []
+        for k, S in enumerate(pantries):
+            for j in S:
+                if j < self.n_ing:
+                    rows.append(j)
+                    cols.append(k)
+        return sparse.csc_matrix((np.ones(len(rows)), (rows, cols)), shape=(self.n_ing, len(pantries)))
+
+    def scores(self, pantries, allow_subst=True):
+        """
+        Returns (score, overlap) arrays of shape (n_recipes, n_pantries).
+        The terms are combined in place, in the same order as the per-recipe formula, so at most
+        four dense n_recipes x n_pantries arrays are alive at once; see SCORE_CELLS.
+        """
+        P = self.pantry_matrix(pantries)
+        req_len, opt_len, req_count = self.req_len[:, None], self.opt_len[:, None], self.req_count[:, None]
+        score = (self.R @ P).toarray()                    # hits, turned into the score below
+        opt_hits = (self.O @ P).toarray()
+        overlap = opt_hits > 0
+        overlap |= score > 0
+        overlap |= req_len == 0
+        covered = None
+        if allow_subst:
+            # recipe ingredients missing from the pantry but covered by a pantry substitute
+            C = (self.B @ P).astype(bool).astype(np.float64)
+            C = C - C.multiply(P)
+            covered = (self.R @ C).toarray()
+            overlap |= covered > 0
+
+        # 0.7 * matched / req_count, matched = req_count - (req_len - hits - covered)
+        np.subtract(req_len, score, out=score)
+        if covered is not None:
+            score -= covered
+        np.subtract(req_count, score, out=score)
+        score /= req_count
+        score *= 0.7
+        if covered is not None:
+            covered /= req_count
+            covered *= 0.18
+            score += covered
+            del covered
+        rarity_bonus = (self.R_rarity @ P).toarray()
+        rarity_bonus *= 0.02
+        score += rarity_bonus
+        del rarity_bonus
+        # optional_penalty = (opt_len - opt_hits) / max(1, opt_len + 1)
+        np.subtract(opt_len, opt_hits, out=opt_hits)
+        opt_hits /= np.maximum(1.0, opt_len + 1)
+        opt_hits *= 0.04
+        score -= opt_hits
+        np.clip(score, 0.0, 1.0, out=score)
+        return score, overlap
+
+    def purchase_gaps(self, S, allow_subst=True):
+        """
+        RecipeMatcher._purchase_gaps over the whole catalog at once: (weight, fills, unlocked_by).
+        The gaps are the nonzeros of R whose ingredient the pantry doesn't cover, kept for the
+        recipes sharing a required ingredient with it, so gap weights are one bincount and the
+        pick completing each recipe a per-row max.
+        """
+        p = np.zeros(self.n_ing)
+        p[[j for j in S if j < self.n_ing]] = 1.0
+        covered = p > 0
+        if allow_subst:
+            covered |= self.B @ p > 0
+        hits = self.R @ covered.astype(np.float64)
+        if self._nnz_row is None:
+            self._nnz_row = np.repeat(np.arange(len(self.recipe_ids), dtype=np.int32), np.diff(self.R.indptr))
+        keep = ~covered[self.R.indices]
+        keep &= (hits > 0)[self._nnz_row]
+        ings = self.R.indices[keep]
+        rows = self._nnz_row[keep]               # nondecreasing: R is CSR
+        with np.errstate(divide='ignore'):
+            inv_gaps = 1.0 / (self.req_len - hits)
+        w = np.bincount(ings, weights=inv_gaps[rows], minlength=self.n_ing)
+        weight = dict(zip(np.flatnonzero(w).tolist(), w[w > 0].tolist()))
+
+        fills = {m: [m] for m in weight}
+        if allow_subst:
+            ms, subs = self.subst_pairs
+            use = (w[ms] > 0) & (ms != subs)
+            for m, sub in zip(ms[use].tolist(), subs[use].tolist()):
+                fills.setdefault(sub, []).append(m)
+
+        def unlocked_by(filled, n, limit):
+            if not len(rows):
+                return [0] * n, []
+            pick = np.full(self.n_ing, n)
+            if filled:
+                pick[list(filled)] = list(filled.values())
+            starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+            done = np.maximum.reduceat(pick[ings], starts)
+            order = np.flatnonzero(done < n)
+            order = order[np.argsort(done[order], kind='stable')[:max(limit, 0)]]
+            return np.bincount(done, minlength=n + 1)[:n].tolist(), self.recipe_ids[rows[starts[order]]].tolist()
+
+        return weight, fills, unlocked_by
+
+    def shortlist(self, S, max_results, allow_subst=True, include_zero_overlap=False):
+        """Recipe ids (catalog order) that can make the top max_results."""
+        return self.shortlist_batch([S], max_results, allow_subst, include_zero_overlap)[0]
+
+    def shortlist_batch(self, pantries, max_results, allow_subst=True, include_zero_overlap=False):
+        """shortlist for several pantries, scored in one pass of matrix products."""
+        out = []
+        step = max(1, self.SCORE_CELLS // max(1, len(self.recipe_ids)))
+        for start in range(0, len(pantries), step):
+            score, overlap = self.scores(pantries[start:start + step], allow_subst)
+            for k in range(score.shape[1]):
+                col = score[:, k]
+                idx = np.arange(len(col)) if include_zero_overlap else np.flatnonzero(overlap[:, k])
+                if 0 < max_results < len(idx):
+                    cand = col[idx]
+                    kth = cand[np.argpartition(-cand, max_results - 1)[max_results - 1]]
+                    idx = idx[cand >= kth - self.EPS]
+                out.append(self.recipe_ids[idx].tolist())
+        return out
@@ -0,0 +1,35 @@
+# vocab.py
+class IngredientVocab:
+    """
+    Interns lowercase ingredient names to dense integer ids.
+    Shared by the matcher and the substitution engine so both index ingredients by id;
+    names are only looked up again at the API boundary. Ids are never reused or
+    reassigned, so snapshots built from an older catalog stay valid after a reload.
+    """
+
+    def __init__(self):
+        self.ids = {}    # name -> id
+        self.names = []  # id -> name
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = len(self.names)
+            self.names.append(name)
+            self.ids[name] = i
+        return i
+
+    def id_of(self, name):
+        """Id of a known name, or None."""
+        return self.ids.get(name)
+
+    def name_of(self, i):
+        return self.names[i]
+
+    def ids_of(self, names):
+        """Set of ids for the known names among names (unknown ones can't match anything)."""
+        ids = self.ids
+        return {ids[n] for n in names if n in ids}